@@ -4,154 +4,1384 @@ AI Multi-Model Coordinator
 Orchestrates multiple AI CLI tools to work together on tasks
 """
 
+import asyncio
+import codecs
+import contextlib
+import contextvars
+import fnmatch
+import hashlib
+import math
 import subprocess
 import json
 import os
+import re
+import shutil
+import signal
+import sys
+import tempfile
+from collections import Counter
 from pathlib import Path
 from datetime import datetime
-from typing import List, Dict, Any, Optional
-import concurrent.futures
+from typing import List, Dict, Any, Optional, Callable, Union
 import time
 
+try:
+    import resource
+except ImportError:  # Windows: no child CPU accounting
+    resource = None
+
+
+class RateLimiter:
+    """Token bucket allowing `calls` model invocations per `period` seconds.
+
+    Callers reserve a token up front and sleep off any deficit, so the bucket
+    needs no lock and keeps its state across event loops (each synchronous
+    `run_model` call runs in its own loop).
+    """
+
+    def __init__(self, calls: float, period: float = 60.0):
+        self.capacity = float(calls)
+        self.tokens = float(calls)
+        self.fill_rate = calls / period
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.fill_rate)
+
+
+def _process_group_kwargs() -> Dict[str, Any]:
+    """Start children in their own process group so the whole tree can be killed"""
+    if sys.platform == "win32":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+async def _drain(stream: Optional[asyncio.StreamReader]) -> None:
+    """Discard a pipe's remaining output up to EOF"""
+    if stream is None:
+        return
+    try:
+        while await stream.read(65536):
+            pass
+    except Exception:
+        pass
+
+
+async def _exited(process: asyncio.subprocess.Process) -> None:
+    """Wait for a child to exit; asyncio only reports the exit once its pipes are closed,
+    so output nobody reads any more is drained"""
+    await asyncio.gather(process.wait(), _drain(process.stdout), _drain(process.stderr))
+
+
+async def _kill_process_tree(process: asyncio.subprocess.Process, grace: float = 5.0):
+    """Terminate a child and everything it spawned (CLI wrappers often fork node/python).
+
+    Callers must have stopped reading the child's pipes; they are drained here.
+    """
+    if sys.platform == "win32":
+        if process.returncode is None:
+            killer = await asyncio.create_subprocess_exec(
+                "taskkill", "/T", "/F", "/PID", str(process.pid),
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            await killer.wait()
+    else:
+        # The group outlives the direct child while any descendant is alive
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        try:
+            await asyncio.wait_for(_exited(process), grace)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    await _exited(process)
+
+
+class ResultCache:
+    """Content-addressed on-disk cache of successful model results.
+
+    Entries live in `<root>/<key[:2]>/<key>.json`. A hit refreshes the file's
+    mtime, which serves as the LRU clock when the cache grows past
+    `max_bytes`; entries older than `ttl` seconds are treated as misses.
+    """
+
+    def __init__(self, root: Path, ttl: float = 24 * 3600, max_bytes: int = 200 * 1024 * 1024):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._size: Optional[int] = None
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if time.time() - entry.get("created", 0) > self.ttl:
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["result"]
+
+    def put(self, key: str, result: Dict[str, Any]):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = json.dumps({"created": time.time(), "result": result}, ensure_ascii=False).encode("utf-8")
+        try:
+            replaced = path.stat().st_size
+        except OSError:
+            replaced = 0
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += len(data) - replaced
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        for path in self.root.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+    def _remove(self, path: Path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except OSError:
+            return
+        if self._size is not None:
+            self._size -= size
+
+    def evict(self):
+        """Drop least recently used entries until the cache is back under 90% of `max_bytes`"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+        self._size = total
+
+    def clear(self):
+        for _, _, path in list(self._entries()):
+            self._remove(path)
+        self._size = 0
+
+
+def prune_stream_logs(directory: Path, max_age: float, max_bytes: int) -> int:
+    """Delete stream logs older than `max_age` seconds, then the oldest until under `max_bytes`.
+
+    Returns the number of files removed.
+    """
+    logs = []
+    for path in directory.glob("*.log"):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        logs.append((stat.st_mtime, stat.st_size, path))
+    logs.sort()
+    
+    cutoff = time.time() - max_age
+    total = sum(size for _, size, _ in logs)
+    removed = 0
+    for mtime, size, path in logs:
+        if mtime >= cutoff and total <= max_bytes:
+            break
+        try:
+            path.unlink()
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+# Output size (chars) up to which an `until` predicate is checked on every read
+UNTIL_EAGER_CHARS = 64 * 1024
+
+
+class StreamCapture:
+    """Incrementally decodes one child output stream.
+
+    Text is kept in memory (so a killed process still yields its partial
+    output), appended to `log_path` as it arrives and passed line by line to
+    `on_line(model, stream_name, line)`. When `until` is reached, `stop` is
+    set so the caller can end the call early. `until` is either a character
+    count or a predicate on the text so far; past UNTIL_EAGER_CHARS the
+    predicate is only re-run once the output has grown by a quarter, so
+    checking stays linear in the output size.
+    """
+
+    def __init__(self, model: str, name: str, started: float, log_path: Optional[Path] = None,
+                 on_line: Optional[Callable[[str, str, str], None]] = None,
+                 until: Optional[Union[int, Callable[[str], bool]]] = None,
+                 stop: Optional[asyncio.Event] = None):
+        self.model = model
+        self.name = name
+        self.started = started
+        self.log_path = log_path
+        self.on_line = on_line
+        self.until = until
+        self.stop = stop
+        self.chunks: List[str] = []
+        self.pending = ""
+        self.first_output: Optional[float] = None
+        self.bytes = 0
+        self.length = 0
+        self._checked_at = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._log = None
+
+    async def pump(self, stream: asyncio.StreamReader):
+        try:
+            while True:
+                data = await stream.read(65536)
+                if not data:
+                    break
+                self.bytes += len(data)
+                self.feed(self._decoder.decode(data))
+            self.feed(self._decoder.decode(b"", final=True))
+        finally:
+            self.close()
+
+    def feed(self, text: str):
+        if not text:
+            return
+        if self.first_output is None:
+            self.first_output = time.perf_counter() - self.started
+        self.chunks.append(text)
+        self.length += len(text)
+        
+        if self.log_path:
+            if self._log is None:
+                self._log = open(self.log_path, 'a', encoding='utf-8')
+            self._log.write(text)
+            self._log.flush()
+        
+        if self.on_line:
+            self.pending += text
+            *lines, self.pending = self.pending.split("\n")
+            for line in lines:
+                self.on_line(self.model, self.name, line)
+        
+        if self.until is not None and self.stop and not self.stop.is_set() and self._until_reached():
+            self.stop.set()
+
+    def _until_reached(self) -> bool:
+        if isinstance(self.until, int):
+            return self.length >= self.until
+        if self.length > UNTIL_EAGER_CHARS and self.length < self._checked_at * 1.25:
+            return False
+        self._checked_at = self.length
+        return self.until(self.text())
+
+    def close(self):
+        if self.on_line and self.pending:
+            self.on_line(self.model, self.name, self.pending)
+            self.pending = ""
+        if self._log:
+            self._log.close()
+            self._log = None
+
+    def text(self) -> str:
+        if len(self.chunks) > 1:
+            self.chunks = ["".join(self.chunks)]
+        return self.chunks[0] if self.chunks else ""
+
+
+# Labels attached to every metrics record made while they are set
+CURRENT_WORKFLOW: contextvars.ContextVar = contextvars.ContextVar("workflow", default=None)
+CURRENT_STEP: contextvars.ContextVar = contextvars.ContextVar("step", default=None)
+
+# Outcomes that count against a model's failure rate ("cancelled" calls, e.g.
+# a debate round timeout, and "stopped" early successes do not)
+FAILED_OUTCOMES = {"failure", "timeout", "spawn_error"}
+
+# Calls a model needs in the metrics window before routing trusts its latency and failure rate
+ROUTER_MIN_CALLS = 3
+# Routing reads at most this much of the end of the metrics log (about 4000 calls)
+ROUTER_METRICS_BYTES = 1024 * 1024
+# Models scoring within this much of the best remaining model are ranked by latency
+ROUTER_TIE_WINDOW = 0.1
+
+
+def _children_cpu_seconds() -> Optional[float]:
+    """User + system CPU of all reaped child processes so far"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (q in 0-100) of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class MetricsLog:
+    """Append-only JSONL log with one record per model call.
+
+    Records carry model, workflow, step, outcome, wall_s, cpu_s (child CPU),
+    first_output_s, output_bytes, exit_code, prompt_bytes and prompt_via.
+    Each record is a single short append, so concurrent writers do not
+    interleave lines.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps({"ts": time.time(), **entry}) + "\n"
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+    def entries(self, since: Optional[float] = None, max_bytes: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Records newer than `since` (epoch seconds), oldest first; unreadable lines are skipped.
+
+        The log is read backwards from its end and reading stops at the first
+        older record or after `max_bytes`, so recent windows stay cheap however
+        long the log grows.
+        """
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return []
+        records = []
+        with f:
+            end = position = f.seek(0, os.SEEK_END)
+            partial = b""
+            while position > 0 and (max_bytes is None or end - position < max_bytes):
+                size = min(64 * 1024, position)
+                position -= size
+                f.seek(position)
+                lines = (f.read(size) + partial).split(b"\n")
+                # The first line may continue in the previous block
+                partial = lines.pop(0) if position > 0 else b""
+                for line in reversed(lines):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if since is not None and entry.get("ts", 0) < since:
+                        records.reverse()
+                        return records
+                    records.append(entry)
+        records.reverse()
+        return records
+
+    @staticmethod
+    def summarize(entries: List[Dict[str, Any]], key: str) -> Dict[str, Dict[str, Any]]:
+        """Latency percentiles of successful calls and failure rate, grouped by `key`"""
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for entry in entries:
+            groups.setdefault(entry.get(key) or "(none)", []).append(entry)
+        
+        summary = {}
+        for name, group in sorted(groups.items()):
+            settled = [e for e in group if e.get("outcome") != "cancelled"]
+            failures = sum(1 for e in settled if e.get("outcome") in FAILED_OUTCOMES)
+            latencies = [e["wall_s"] for e in settled if e.get("outcome") not in FAILED_OUTCOMES]
+            cpu = [e["cpu_s"] for e in group if e.get("cpu_s") is not None]
+            summary[name] = {
+                "calls": len(group),
+                "cancelled": len(group) - len(settled),
+                "failures": failures,
+                "failure_rate": failures / len(settled) if settled else 0.0,
+                "p50_s": percentile(latencies, 50),
+                "p90_s": percentile(latencies, 90),
+                "p95_s": percentile(latencies, 95),
+                "cpu_s": sum(cpu) if cpu else None,
+                "output_bytes": sum(e.get("output_bytes", 0) for e in group)
+            }
+        return summary
+
+
+def render_prompt(template: str, upstream: Dict[str, str]) -> str:
+    """Fill `{context}` and `{step_name}` placeholders from upstream step outputs.
+
+    `{context}` is the single upstream output, or every upstream output under
+    a `### step_name` heading when there are several. Other braces (code
+    samples, JSON) are left untouched.
+    """
+    if len(upstream) == 1:
+        context = next(iter(upstream.values()))
+    else:
+        context = "\n\n".join(f"### {name}\n{output}" for name, output in upstream.items())
+    values = {**upstream, "context": context}
+    return re.sub(r"\{(\w+)\}", lambda m: values.get(m.group(1), m.group(0)), template)
+
+
+def topological_order(steps: List[Dict[str, Any]]) -> List[str]:
+    """Step names in dependency order; raises ValueError for unknown dependencies or cycles"""
+    names = [step["name"] for step in steps]
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicate step names in workflow")
+    
+    dependents: Dict[str, List[str]] = {name: [] for name in names}
+    pending = {}
+    for step in steps:
+        deps = step.get("depends_on", [])
+        for dep in deps:
+            if dep not in dependents:
+                raise ValueError(f"Step '{step['name']}' depends on unknown step '{dep}'")
+            dependents[dep].append(step["name"])
+        pending[step["name"]] = len(deps)
+    
+    ready = [name for name in names if pending[name] == 0]
+    order = []
+    while ready:
+        name = ready.pop(0)
+        order.append(name)
+        for dependent in dependents[name]:
+            pending[dependent] -= 1
+            if pending[dependent] == 0:
+                ready.append(dependent)
+    
+    if len(order) != len(names):
+        raise ValueError(f"Workflow has a dependency cycle among: {sorted(set(names) - set(order))}")
+    return order
+
+
+def critical_path(steps: List[Dict[str, Any]], timings: Dict[str, tuple]) -> List[str]:
+    """The chain of steps that determined the workflow's finish time.
+
+    Starts from the step that finished last and repeatedly follows the
+    dependency that finished last.
+    """
+    if not timings:
+        return []
+    deps = {step["name"]: step.get("depends_on", []) for step in steps}
+    name = max(timings, key=lambda n: timings[n][1])
+    path = [name]
+    while deps[name]:
+        name = max(deps[name], key=lambda n: timings[n][1])
+        path.append(name)
+    return list(reversed(path))
+
+
+# Words that never count as consensus themes; they also split n-gram phrases
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being
+below between both but by can could did do does doing down during each either etc every few for
+from further had has have having he her here hers him his how however i if in into is it its itself
+just let like may me might more most must my no nor not now of off on once only or other our ours
+out over own per same shall she should so some such than that the their theirs them then there
+these they this those through thus to too under until up upon us use used using very via was we
+well were what when where whether which while who whom why will with within without would yes yet
+you your yours e.g i.e first second third one two three also new make ensure consider provide
+""".split())
+
+# A word, or sentence/clause punctuation (group 1 is None) that ends a phrase
+TOKEN_PATTERN = re.compile(r"([a-z0-9][a-z0-9_+#'-]*)|[.,;:!?()\[\]{}<>\"|/\\\n]")
+
+# Agreement labels by the mean share of each output's words that others also use
+AGREEMENT_LEVELS = ((0.5, "high"), (0.25, "moderate"), (0.0, "low"))
+
+
+def tokenize(text: str) -> List[List[str]]:
+    """Lower-cased word runs of `text`, split at punctuation and wherever a stopword or short token occurs"""
+    phrases = []
+    current: List[str] = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        token = (match.group(1) or "").strip("'-")
+        if len(token) < 3 or token in STOPWORDS or token.isdigit():
+            if current:
+                phrases.append(current)
+                current = []
+        else:
+            current.append(token)
+    if current:
+        phrases.append(current)
+    return phrases
+
+
+def term_counts(text: str, max_ngram: int = 3) -> Counter:
+    """Counts of every word and in-phrase n-gram (up to `max_ngram` words) in one pass"""
+    counts: Counter = Counter()
+    for phrase in tokenize(text):
+        for n in range(1, max_ngram + 1):
+            for start in range(len(phrase) - n + 1):
+                counts[" ".join(phrase[start:start + n])] += 1
+    return counts
+
+
+def position_similarity(a: str, b: str) -> float:
+    """Cosine similarity of two texts' word and bigram counts (0 = unrelated, 1 = same terms)"""
+    counts_a, counts_b = term_counts(a, max_ngram=2), term_counts(b, max_ngram=2)
+    if not counts_a or not counts_b:
+        return 0.0
+    if len(counts_a) > len(counts_b):
+        counts_a, counts_b = counts_b, counts_a
+    dot = sum(count * counts_b[term] for term, count in counts_a.items() if term in counts_b)
+    norm_a = math.sqrt(sum(count * count for count in counts_a.values()))
+    norm_b = math.sqrt(sum(count * count for count in counts_b.values()))
+    return dot / (norm_a * norm_b)
+
+
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+class PromptAssembler:
+    """Keeps prompts within a token budget.
+
+    Token counts are estimated from character length, which is close enough
+    for English prose and code. Oversized context is shrunk by extractive
+    summarisation: sentences (or list lines) are ranked by how many of the
+    text's frequent terms they contain, and the best ones are kept in their
+    original order. Repeated sentences are dropped across sections.
+    """
+
+    def __init__(self, max_tokens: int = 6000, chars_per_token: float = 4.0):
+        self.max_tokens = max_tokens
+        self.chars_per_token = chars_per_token
+
+    def estimate_tokens(self, text: str) -> int:
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut `text` to `max_tokens` at a word boundary"""
+        limit = int(max_tokens * self.chars_per_token)
+        if len(text) <= limit:
+            return text
+        cut = text.rfind(" ", 0, max(0, limit - 2))
+        return text[:cut if cut > limit // 2 else max(0, limit - 2)].rstrip() + " …"
+
+    @staticmethod
+    def _key(sentence: str) -> str:
+        return " ".join(sentence.lower().split())
+
+    def split(self, text: str) -> List[str]:
+        return [unit.strip() for unit in SENTENCE_BREAK.split(text) if unit.strip()]
+
+    def sentence_keys(self, text: str) -> set:
+        """Normalised sentences of `text`, to seed `dedupe`"""
+        return {self._key(unit) for unit in self.split(text)}
+
+    def summarize(self, text: str, max_tokens: int) -> str:
+        """Extractive summary of `text` within `max_tokens` (unchanged if it already fits)"""
+        if self.estimate_tokens(text) <= max_tokens:
+            return text
+        
+        units = []
+        seen = set()
+        for unit in self.split(text):
+            key = self._key(unit)
+            if len(key) < 20 or key not in seen:
+                seen.add(key)
+                units.append(unit)
+        
+        frequencies = term_counts(text, max_ngram=1)
+        
+        def score(index: int) -> float:
+            terms = [term for phrase in tokenize(units[index]) for term in phrase]
+            if not terms:
+                return 0.0
+            # Favour dense sentences and, slightly, those early in the text
+            return sum(frequencies[term] for term in terms) / math.sqrt(len(terms)) / (1 + index * 0.01)
+        
+        budget = int(max_tokens * self.chars_per_token)
+        chosen = []
+        used = 0
+        for index in sorted(range(len(units)), key=score, reverse=True):
+            size = len(units[index]) + 1
+            if used + size <= budget:
+                chosen.append(index)
+                used += size
+        if not chosen:
+            return self.truncate(text, max_tokens)
+        return "\n".join(units[index] for index in sorted(chosen))
+
+    def dedupe(self, sections: Dict[str, str], seen: Optional[set] = None) -> Dict[str, str]:
+        """Drop sentences already present in earlier sections (or in `seen`).
+
+        Short units (closing braces, list markers) are always kept.
+        """
+        seen = set() if seen is None else seen
+        deduped = {}
+        for name, text in sections.items():
+            kept = []
+            for unit in self.split(text):
+                key = self._key(unit)
+                if len(key) < 20:
+                    kept.append(unit)
+                elif key not in seen:
+                    seen.add(key)
+                    kept.append(unit)
+            deduped[name] = "\n".join(kept)
+        return deduped
+
+    def fit_sections(self, template: str, sections: Dict[str, str]) -> Dict[str, str]:
+        """Dedupe `sections` and shrink them so `template` plus sections fit the budget.
+
+        The budget left after the template is shared equally; sections under
+        their share give the unused remainder to the others.
+        """
+        if not sections:
+            return sections
+        available = max(200, self.max_tokens - self.estimate_tokens(template))
+        if sum(self.estimate_tokens(text) for text in sections.values()) <= available:
+            return sections
+        
+        sections = self.dedupe(sections, self.sentence_keys(template))
+        sizes = {name: self.estimate_tokens(text) for name, text in sections.items()}
+        remaining = available
+        pending = sorted(sections, key=lambda name: sizes[name])
+        fitted = {}
+        while pending:
+            share = remaining // len(pending)
+            name = pending.pop(0)
+            fitted[name] = self.summarize(sections[name], share)
+            remaining -= self.estimate_tokens(fitted[name])
+        return {name: fitted[name] for name in sections}
+
+
+# Memory-backed directory for "file" prompt delivery (falls back to the system temp dir)
+PROMPT_FILE_DIR = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+PROMPT_FILE_PLACEHOLDER = "{prompt_file}"
+
+
+async def _feed_stdin(stream: asyncio.StreamWriter, data: bytes) -> None:
+    """Write the prompt to a child's stdin and close it; a child that exits early is not an error"""
+    try:
+        stream.write(data)
+        await stream.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        stream.close()
+
+
+def _remove_prompt_file(path: Optional[str]) -> None:
+    if path:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+# Directories never walked when expanding `cache_files` patterns
+CACHE_SKIP_DIRS = {".git", "node_modules", "vendor", "__pycache__", ".next", "AI_COORDINATION"}
+
+
 class AICoordinator:
     """Coordinates multiple AI models working together"""
     
-    def __init__(self, project_dir: str = r"C:\Users\hyper\fwber"):
+    def __init__(self, project_dir: str = r"C:\Users\hyper\fwber", max_concurrency: int = 4,
+                 cache_ttl: float = 24 * 3600, cache_max_bytes: int = 200 * 1024 * 1024,
+                 max_prompt_tokens: int = 6000, stream_retention: float = 7 * 24 * 3600,
+                 stream_max_bytes: int = 100 * 1024 * 1024):
         self.project_dir = project_dir
         self.results_dir = Path("AI_COORDINATION/orchestration_results")
         self.results_dir.mkdir(parents=True, exist_ok=True)
+        # Live stdout/stderr of every model call, written as it arrives; logs older
+        # than stream_retention seconds, or beyond stream_max_bytes, are pruned on startup
+        self.streams_dir = self.results_dir / "streams"
+        self.streams_dir.mkdir(parents=True, exist_ok=True)
+        prune_stream_logs(self.streams_dir, stream_retention, stream_max_bytes)
+        # Per-step checkpoints of workflow runs, one directory per run id
+        self.runs_dir = self.results_dir / "runs"
+        # One line per model call: latency, child CPU, output size and outcome
+        self.metrics = MetricsLog(self.results_dir / "metrics.jsonl")
+        self._child_cpu_mark = _children_cpu_seconds()
         
-        # Available AI models
+        # Context passed between steps and debate rounds is kept under
+        # max_prompt_tokens (the default stays well inside the ~32K character
+        # Windows command line and Linux's 128 KiB single-argument limit)
+        self.prompts = PromptAssembler(max_prompt_tokens)
+        
+        # Successful results keyed by model, command, prompt and referenced files;
+        # set cache_ttl=0 to disable
+        self.cache = ResultCache(Path("AI_COORDINATION/cache"), cache_ttl, cache_max_bytes) if cache_ttl else None
+        self._digest_memo: Dict[Any, str] = {}
+        
+        # Available AI models; "rate_limit" caps invocations per minute (None = unlimited).
+        # "prompt_via" is how the prompt reaches the CLI: "argv" (appended to the
+        # command), "stdin" (piped) or "file" (path of a temp file on tmpfs, substituted
+        # for "{prompt_file}" in the command or appended). argv is limited by ARG_MAX.
         self.models = {
             "codex": {
                 "command": ["codex", "-c", "model_provider=anthropic", "exec"],
                 "strengths": ["coding", "refactoring", "debugging"],
-                "description": "GPT-based coding assistant"
+                "description": "GPT-based coding assistant",
+                "rate_limit": None,
+                "prompt_via": "stdin"
             },
             "claude": {
                 "command": ["claude", "--model", "claude-sonnet-4-5-20250929", "-p"],
                 "strengths": ["architecture", "analysis", "documentation"],
-                "description": "Claude for system design"
+                "description": "Claude for system design",
+                "rate_limit": None,
+                "prompt_via": "stdin"
             },
             "gemini": {
                 "command": ["gemini"],
                 "strengths": ["research", "explanation", "brainstorming"],
-                "description": "Gemini for general tasks"
+                "description": "Gemini for general tasks",
+                "rate_limit": None,
+                "prompt_via": "stdin"
             }
         }
+        
+        # Async engine: at most max_concurrency model processes at once
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop = None
+        self._rate_limiters: Dict[str, RateLimiter] = {}
+    
+    def _failure(self, model_name: str, error: str) -> Dict[str, Any]:
+        return {
+            "model": model_name,
+            "success": False,
+            "error": error,
+            "output": None,
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    @contextlib.contextmanager
+    def workflow(self, name: str):
+        """Label the model calls made inside the block with workflow `name` in the metrics.
+
+        An enclosing label wins, so a workflow built from other workflows is
+        recorded under the outer name.
+        """
+        token = CURRENT_WORKFLOW.set(name) if CURRENT_WORKFLOW.get() is None else None
+        try:
+            yield
+        finally:
+            if token is not None:
+                CURRENT_WORKFLOW.reset(token)
+    
+    def _take_child_cpu(self) -> Optional[float]:
+        """Child CPU seconds reaped since the previous call.
+
+        Taken right after a model process exits, so it is that process's CPU
+        (including its waited-for descendants); children that exit at the
+        same moment may have their CPU attributed to each other.
+        """
+        now = _children_cpu_seconds()
+        if now is None or self._child_cpu_mark is None:
+            return None
+        spent, self._child_cpu_mark = now - self._child_cpu_mark, now
+        return round(spent, 3)
+    
+    def _record_call(self, model_name: str, outcome: str, wall_s: float, **fields) -> None:
+        self.metrics.record({
+            "model": model_name,
+            "workflow": CURRENT_WORKFLOW.get(),
+            "step": CURRENT_STEP.get(),
+            "outcome": outcome,
+            "wall_s": round(wall_s, 3),
+            **fields
+        })
+    
+    def metrics_summary(self, days: Optional[float] = None, max_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """p50/p90/p95 latency and failure rate per model and per workflow
+        (over at most the last `max_bytes` of the log)"""
+        since = time.time() - days * 86400 if days else None
+        entries = self.metrics.entries(since, max_bytes)
+        return {
+            "calls": len(entries),
+            "by_model": MetricsLog.summarize(entries, "model"),
+            "by_workflow": MetricsLog.summarize(entries, "workflow")
+        }
+    
+    def print_metrics_summary(self, days: Optional[float] = None) -> None:
+        summary = self.metrics_summary(days)
+        window = f"last {days:g} days" if days else "all time"
+        print(f"📊 Model call metrics ({summary['calls']} calls, {window})")
+        
+        def seconds(value):
+            return f"{value:8.1f}" if value is not None else f"{'-':>8}"
+        
+        for title, groups in (("Model", summary["by_model"]), ("Workflow", summary["by_workflow"])):
+            print()
+            print(f"{title:<32} {'calls':>6} {'fail%':>6} {'p50 s':>8} {'p95 s':>8} {'cpu s':>8} {'out KB':>8}")
+            for name, stats in groups.items():
+                print(f"{name:<32} {stats['calls']:>6} {stats['failure_rate'] * 100:>6.1f} "
+                      f"{seconds(stats['p50_s'])} {seconds(stats['p95_s'])} {seconds(stats['cpu_s'])} "
+                      f"{stats['output_bytes'] / 1024:>8.1f}")
+    
+    def _model_stats(self, days: float = 7) -> Dict[str, Dict[str, Any]]:
+        """Per-model metrics from the last `days`, only for models with enough settled calls"""
+        stats = self.metrics_summary(days, ROUTER_METRICS_BYTES)["by_model"]
+        return {
+            model: entry for model, entry in stats.items()
+            if entry["calls"] - entry.get("cancelled", 0) >= ROUTER_MIN_CALLS
+        }
     
-    def run_model(self, model_name: str, prompt: str, timeout: int = 120) -> Dict[str, Any]:
-        """Run a single AI model with a prompt"""
-        print(f"🤖 Running {model_name}...")
+    def route(self, task, count: Optional[int] = None, days: float = 7) -> List[str]:
+        """Models best suited to `task` (a strength tag or list of tags), best first.
+
+        Models are ranked by the share of the task's tags among their
+        declared strengths, discounted by their measured failure rate over
+        the last `days`. Models within `ROUTER_TIE_WINDOW` of the best
+        remaining score are ordered by measured p50 latency, then by
+        registry order. Models whose CLI is not on PATH are
+        left out unless none is found.
+        """
+        tags = [task] if isinstance(task, str) else list(task)
+        stats = self._model_stats(days)
+        available = [name for name, config in self.models.items() if shutil.which(config["command"][0])]
+        candidates = available or list(self.models)
+        
+        def score(name: str) -> float:
+            strengths = set(self.models[name]["strengths"])
+            match = sum(1 for tag in tags if tag in strengths) / len(tags) if tags else 0.0
+            entry = stats.get(name)
+            health = 1.0 - entry["failure_rate"] if entry else 1.0
+            return match * health
+        
+        def latency(name: str) -> float:
+            entry = stats.get(name)
+            return entry["p50_s"] if entry and entry["p50_s"] is not None else math.inf
         
+        scores = {name: score(name) for name in candidates}
+        remaining = sorted(candidates, key=lambda name: -scores[name])
+        ranked: List[str] = []
+        while remaining:
+            best = scores[remaining[0]]
+            tied = [name for name in remaining if best - scores[name] <= ROUTER_TIE_WINDOW + 1e-9]
+            ranked.extend(sorted(tied, key=lambda name: (latency(name), candidates.index(name))))
+            remaining = remaining[len(tied):]
+        return ranked[:count] if count else ranked
+    
+    def _concurrency_slot(self) -> asyncio.Semaphore:
+        """Global concurrency limit for the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+    
+    def _rate_limiter(self, model_name: str) -> Optional[RateLimiter]:
+        rate_limit = self.models[model_name].get("rate_limit")
+        if not rate_limit:
+            return None
+        limiter = self._rate_limiters.get(model_name)
+        if limiter is None:
+            limiter = self._rate_limiters[model_name] = RateLimiter(rate_limit)
+        return limiter
+    
+    def _file_digest(self, path: Path) -> str:
+        stat = path.stat()
+        memo_key = (str(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digest_memo.get(memo_key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(chunk)
+            digest = self._digest_memo[memo_key] = sha.hexdigest()
+        return digest
+    
+    def file_digests(self, patterns: List[str]) -> Dict[str, Optional[str]]:
+        """Content digests of the project files matched by `patterns`.
+
+        Plain paths are relative to the project dir; patterns containing
+        wildcards are matched (fnmatch, `*` also crosses directories) against
+        every project file outside CACHE_SKIP_DIRS. Patterns matching nothing
+        map to None so a file appearing later changes the digest.
+        """
+        root = Path(self.project_dir)
+        digests: Dict[str, Optional[str]] = {}
+        globs = []
+        for pattern in patterns:
+            if any(char in pattern for char in "*?["):
+                globs.append(pattern)
+                continue
+            path = root / pattern
+            digests[pattern] = self._file_digest(path) if path.is_file() else None
+        
+        if globs:
+            matched = set()
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames if d not in CACHE_SKIP_DIRS]
+                for filename in filenames:
+                    rel = Path(dirpath, filename).relative_to(root).as_posix()
+                    for pattern in globs:
+                        if fnmatch.fnmatch(rel, pattern) or fnmatch.fnmatch(filename, pattern):
+                            digests[rel] = self._file_digest(Path(dirpath, filename))
+                            matched.add(pattern)
+                            break
+            for pattern in globs:
+                if pattern not in matched:
+                    digests[pattern] = None
+        return digests
+    
+    def _prompt_delivery(self, model_config: Dict[str, Any], prompt: str) -> tuple:
+        """Command line, stdin bytes and temp file path for the model's "prompt_via" mode"""
+        mode = model_config.get("prompt_via", "argv")
+        command = list(model_config["command"])
+        if mode == "argv":
+            return mode, command + [prompt], None, None
+        
+        data = prompt.encode("utf-8")
+        if mode == "stdin":
+            return mode, command, data, None
+        if mode == "file":
+            fd, path = tempfile.mkstemp(prefix="prompt_", suffix=".txt", dir=PROMPT_FILE_DIR)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            if PROMPT_FILE_PLACEHOLDER in command:
+                command = [path if part == PROMPT_FILE_PLACEHOLDER else part for part in command]
+            else:
+                command.append(path)
+            return mode, command, None, path
+        raise ValueError(f"Unknown prompt_via mode: {mode}")
+    
+    def cache_key(self, model_name: str, prompt: str, cache_files: Optional[List[str]] = None) -> str:
+        """Content address of a model call: model, command, prompt and referenced files"""
+        payload = {
+            "model": model_name,
+            "command": self.models[model_name]["command"],
+            "prompt": prompt,
+            "files": self.file_digests(cache_files) if cache_files else None
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+    
+    async def run_model_async(self, model_name: str, prompt: str, timeout: int = 120,
+                              cache_files: Optional[List[str]] = None,
+                              use_cache: bool = True,
+                              on_line: Optional[Callable[[str, str, str], None]] = None,
+                              until: Optional[Union[int, Callable[[str], bool]]] = None) -> Dict[str, Any]:
+        """Run a single AI model with a prompt on the asyncio engine.
+
+        Output is streamed: each line goes to `on_line(model, stream, line)`
+        and both streams are appended to a log in `streams_dir` as they
+        arrive. A timeout keeps the output received so far ("partial": True).
+        If `until(stdout_so_far)` returns True (or stdout reaches `until`
+        characters, when it is a number) the process is stopped early
+        and the call succeeds with the output up to that point. Results carry
+        "first_output_s" (time to first stdout byte) and "duration_s".
+        The prompt is passed as the model's "prompt_via" mode declares;
+        results record the mode ("prompt_via") and size ("prompt_bytes").
+
+        Successful results are cached on disk, keyed by the model, its
+        command, the prompt and the digests of `cache_files` (project files
+        the prompt refers to); a hit returns immediately with "cached": True.
+        Otherwise waits for the model's rate limit and a global concurrency
+        slot; the timeout covers only the model process itself. On timeout or
+        cancellation the child's whole process tree is killed.
+        """
         if model_name not in self.models:
-            return {
-                "model": model_name,
-                "success": False,
-                "error": f"Unknown model: {model_name}",
-                "output": None,
-                "timestamp": datetime.now().isoformat()
-            }
+            return self._failure(model_name, f"Unknown model: {model_name}")
         
         model_config = self.models[model_name]
-        command = model_config["command"] + [prompt]
+        prompt_via = model_config.get("prompt_via", "argv")
+        prompt_bytes = len(prompt.encode("utf-8"))
         
-        try:
-            result = subprocess.run(
-                command,
-                capture_output=True,
-                text=True,
-                timeout=timeout,
-                cwd=self.project_dir
-            )
+        cache_key = None
+        if self.cache and use_cache:
+            cache_key = self.cache_key(model_name, prompt, cache_files)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print(f"💾 {model_name}: cached result")
+                return {**cached, "cached": True}
+        
+        limiter = self._rate_limiter(model_name)
+        if limiter:
+            await limiter.acquire()
+        
+        async with self._concurrency_slot():
+            print(f"🤖 Running {model_name}...")
+            prompt_file = None
+            try:
+                prompt_via, command, stdin_data, prompt_file = self._prompt_delivery(model_config, prompt)
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    cwd=self.project_dir,
+                    **_process_group_kwargs()
+                )
+            except Exception as e:
+                _remove_prompt_file(prompt_file)
+                self._record_call(model_name, "spawn_error", 0.0, prompt_bytes=prompt_bytes, prompt_via=prompt_via)
+                return {**self._failure(model_name, str(e)), "prompt_via": prompt_via, "prompt_bytes": prompt_bytes}
             
-            success = result.returncode == 0
-            output = result.stdout if success else result.stderr
+            started = time.perf_counter()
+            stem = str(self.streams_dir / f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{model_name}")
+            stop = asyncio.Event()
+            out = StreamCapture(model_name, "stdout", started, Path(stem + ".log"), on_line, until, stop)
+            err = StreamCapture(model_name, "stderr", started, Path(stem + ".err.log"), on_line)
+            io = [out.pump(process.stdout), err.pump(process.stderr), process.wait()]
+            if stdin_data is not None:
+                io.append(_feed_stdin(process.stdin, stdin_data))
+            io_task = asyncio.ensure_future(asyncio.gather(*io))
+            stop_task = asyncio.ensure_future(stop.wait())
             
-            return {
-                "model": model_name,
-                "success": success,
-                "output": output,
-                "error": None if success else result.stderr,
-                "timestamp": datetime.now().isoformat(),
-                "strengths": model_config["strengths"]
-            }
+            error = None
+            partial = False
+            try:
+                done, _ = await asyncio.wait(
+                    {io_task, stop_task}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if io_task in done:
+                    io_task.result()
+                else:
+                    partial = True
+                    if stop_task not in done:
+                        error = f"Timeout after {timeout} seconds"
+            except asyncio.CancelledError:
+                io_task.cancel()
+                await asyncio.gather(io_task, return_exceptions=True)
+                await _kill_process_tree(process)
+                _remove_prompt_file(prompt_file)
+                self._record_call(
+                    model_name, "cancelled", time.perf_counter() - started, cpu_s=self._take_child_cpu(),
+                    output_bytes=out.bytes, exit_code=process.returncode,
+                    prompt_bytes=prompt_bytes, prompt_via=prompt_via
+                )
+                raise
+            except Exception as e:
+                error = str(e)
+            finally:
+                stop_task.cancel()
             
-        except subprocess.TimeoutExpired:
-            return {
-                "model": model_name,
-                "success": False,
-                "error": f"Timeout after {timeout} seconds",
-                "output": None,
-                "timestamp": datetime.now().isoformat()
-            }
-        except Exception as e:
-            return {
-                "model": model_name,
-                "success": False,
-                "error": str(e),
-                "output": None,
-                "timestamp": datetime.now().isoformat()
-            }
+            if partial or error:
+                io_task.cancel()
+                await asyncio.gather(io_task, return_exceptions=True)
+                await _kill_process_tree(process)
+            _remove_prompt_file(prompt_file)
+            cpu_s = self._take_child_cpu()
+        
+        stdout, stderr = out.text(), err.text()
+        success = error is None and (stop.is_set() or process.returncode == 0)
+        if error is None and not success:
+            error = stderr
+        duration_s = time.perf_counter() - started
+        
+        if success:
+            outcome = "stopped" if partial else "success"
+        else:
+            outcome = "timeout" if partial else "failure"
+        self._record_call(
+            model_name, outcome, duration_s, cpu_s=cpu_s,
+            first_output_s=round(out.first_output, 3) if out.first_output is not None else None,
+            output_bytes=out.bytes, exit_code=process.returncode,
+            prompt_bytes=prompt_bytes, prompt_via=prompt_via
+        )
+        
+        result = {
+            "model": model_name,
+            "success": success,
+            "output": stdout if success or partial else stderr,
+            "error": error,
+            "timestamp": datetime.now().isoformat(),
+            "strengths": model_config["strengths"],
+            "partial": partial,
+            "first_output_s": round(out.first_output, 3) if out.first_output is not None else None,
+            "duration_s": round(duration_s, 3),
+            "cpu_s": cpu_s,
+            "output_bytes": out.bytes,
+            "exit_code": process.returncode,
+            "outcome": outcome,
+            "stream_file": stem + ".log",
+            "prompt_via": prompt_via,
+            "prompt_bytes": prompt_bytes
+        }
+        # Early-stopped output depends on `until`, which is not part of the key
+        if success and not partial and cache_key:
+            self.cache.put(cache_key, result)
+        return result
     
-    def parallel_execution(self, models: List[str], prompt: str, timeout: int = 120) -> List[Dict[str, Any]]:
+    async def run_hedged_async(self, models: List[str], prompt: str, timeout: int = 120,
+                               cache_files: Optional[List[str]] = None, hedge_after: Optional[float] = None,
+                               **kwargs) -> Dict[str, Any]:
+        """Run `models[0]`, starting the next model as a backup whenever the
+        latest one has not answered within its p90 latency (or `hedge_after`
+        seconds) or has failed. The first success wins and the calls still
+        running are cancelled, killing their processes. Without latency
+        history a backup starts only on failure.
+
+        The result carries "attempts" (models started, in order) and
+        "hedged" (whether a backup was started).
+        """
+        stats = self._model_stats() if hedge_after is None else {}
+        
+        def hedge_delay(model: str) -> Optional[float]:
+            if hedge_after is not None:
+                return hedge_after
+            entry = stats.get(model)
+            return entry["p90_s"] if entry else None
+        
+        running: Dict[asyncio.Future, str] = {}
+        attempts: List[str] = []
+        
+        def start(model: str) -> None:
+            attempts.append(model)
+            if len(attempts) > 1:
+                print(f"🛡️ Hedging with {model}")
+            running[asyncio.ensure_future(self.run_model_async(model, prompt, timeout, cache_files, **kwargs))] = model
+        
+        start(models[0])
+        backups = list(models[1:])
+        delay = hedge_delay(models[0])
+        winner = None
+        failures = []
+        try:
+            while running and winner is None:
+                done, _ = await asyncio.wait(
+                    running, timeout=delay if backups else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    running.pop(task)
+                    result = task.result()
+                    if result["success"] and winner is None:
+                        winner = result
+                    elif not result["success"]:
+                        failures.append(result)
+                if winner is None and backups and (not done or failures and not running):
+                    start(backups[0])
+                    delay = hedge_delay(backups.pop(0))
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+        
+        result = winner or failures[-1]
+        return {**result, "attempts": attempts, "hedged": len(attempts) > 1}
+    
+    def run_hedged(self, models: List[str], prompt: str, timeout: int = 120,
+                   cache_files: Optional[List[str]] = None, hedge_after: Optional[float] = None) -> Dict[str, Any]:
+        """Blocking wrapper around `run_hedged_async`"""
+        return asyncio.run(self.run_hedged_async(models, prompt, timeout, cache_files, hedge_after))
+    
+    def step_models(self, step: Dict[str, Any]) -> List[str]:
+        """Primary model of a workflow step followed by its hedge backups.
+
+        A step names its "model" (optionally with "hedge_with") or describes
+        its "task" as strength tags; a task step is routed to the best model
+        and, unless "hedge" is False, hedged with the runner-up.
+        """
+        if "model" in step:
+            return [step["model"]] + list(step.get("hedge_with", []))
+        return self.route(step["task"], count=2 if step.get("hedge", True) else 1)
+    
+    def new_run_id(self, workflow: str) -> str:
+        return f"{workflow}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    
+    def latest_run_id(self, workflow: str) -> Optional[str]:
+        """Most recent run id of `workflow` that has checkpoints, if any"""
+        if not self.runs_dir.exists():
+            return None
+        runs = sorted(
+            path.name for path in self.runs_dir.iterdir()
+            if path.is_dir() and path.name.startswith(f"{workflow}_")
+        )
+        return runs[-1] if runs else None
+    
+    def _checkpoint_path(self, run_id: str, step_name: str) -> Path:
+        safe_name = re.sub(r"[^\w.-]", "_", step_name)
+        return self.runs_dir / run_id / f"{safe_name}.json"
+    
+    async def run_step_async(self, run_id: Optional[str], step_name: str, model_name: str, prompt: str,
+                             timeout: int = 120, cache_files: Optional[List[str]] = None,
+                             resume: bool = False, hedge_with: Optional[List[str]] = None,
+                             **kwargs) -> Dict[str, Any]:
+        """Run one workflow step, checkpointing its result under `run_id`.
+
+        With `resume`, a step whose checkpoint succeeded for the same inputs
+        (model, command, rendered prompt and `cache_files` digests) is not run
+        again; its stored result is returned with "resumed": True. Without a
+        `run_id` this is a plain `run_model_async` call. With `hedge_with`
+        the step is hedged (see `run_hedged_async`) and a checkpoint from any
+        of its models is reused.
+        """
+        models = [model_name] + list(hedge_with or [])
+        if not run_id or model_name not in self.models:
+            return await self._run_as_step(step_name, models, prompt, timeout, cache_files, **kwargs)
+        
+        path = self._checkpoint_path(run_id, step_name)
+        if resume:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    checkpoint = json.load(f)
+            except (OSError, ValueError):
+                checkpoint = None
+            stored = checkpoint["result"] if checkpoint else None
+            if (stored and stored["success"] and stored["model"] in models
+                    and checkpoint["inputs"] == self.cache_key(stored["model"], prompt, cache_files)):
+                print(f"⏭️ {step_name}: reusing checkpoint from run {run_id}")
+                return {**stored, "resumed": True}
+        
+        result = await self._run_as_step(step_name, models, prompt, timeout, cache_files, **kwargs)
+        inputs = self.cache_key(result["model"], prompt, cache_files)
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"run_id": run_id, "step": step_name, "inputs": inputs, "result": result},
+                      f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return result
+    
+    async def _run_as_step(self, step_name: str, models: List[str], *args, **kwargs) -> Dict[str, Any]:
+        """Run (or hedge, given several models) with metrics records labelled as `step_name`"""
+        token = CURRENT_STEP.set(step_name)
+        try:
+            if len(models) > 1:
+                return await self.run_hedged_async(models, *args, **kwargs)
+            return await self.run_model_async(models[0], *args, **kwargs)
+        finally:
+            CURRENT_STEP.reset(token)
+    
+    def run_model(self, model_name: str, prompt: str, timeout: int = 120,
+                  cache_files: Optional[List[str]] = None, use_cache: bool = True,
+                  on_line: Optional[Callable[[str, str, str], None]] = None,
+                  until: Optional[Union[int, Callable[[str], bool]]] = None) -> Dict[str, Any]:
+        """Run a single AI model with a prompt (blocking; not for use inside an event loop)"""
+        return asyncio.run(self.run_model_async(model_name, prompt, timeout, cache_files, use_cache, on_line, until))
+    
+    async def run_batch_async(self, jobs: List[Dict[str, Any]], timeout: int = 120) -> List[Dict[str, Any]]:
+        """Run many {"model", "prompt"[, "timeout", "cache_files"]} jobs concurrently within the engine limits.
+
+        Results are returned in job order.
+        """
+        async def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+            try:
+                return await self.run_model_async(
+                    job["model"], job["prompt"], job.get("timeout", timeout), job.get("cache_files")
+                )
+            except Exception as e:
+                return self._failure(job["model"], str(e))
+        
+        return list(await asyncio.gather(*(run_job(job) for job in jobs)))
+    
+    def run_batch(self, jobs: List[Dict[str, Any]], timeout: int = 120) -> List[Dict[str, Any]]:
+        """Blocking wrapper around `run_batch_async`"""
+        return asyncio.run(self.run_batch_async(jobs, timeout))
+    
+    def fan_out(self, models: List[str], prompts: List[str], timeout: int = 120) -> List[Dict[str, Any]]:
+        """Run every prompt against every model; each result carries its `prompt_index`"""
+        print(f"\n🚀 Fan-out: {len(prompts)} prompts x {len(models)} models "
+              f"(max {self.max_concurrency} concurrent)")
+        
+        jobs = [
+            {"model": model, "prompt": prompt, "prompt_index": index}
+            for index, prompt in enumerate(prompts)
+            for model in models
+        ]
+        results = self.run_batch(jobs, timeout)
+        for job, result in zip(jobs, results):
+            result["prompt_index"] = job["prompt_index"]
+        
+        succeeded = sum(1 for r in results if r["success"])
+        print(f"✓ {succeeded}/{len(results)} calls succeeded")
+        return results
+    
+    def parallel_execution(self, models: List[str], prompt: str, timeout: int = 120,
+                           cache_files: Optional[List[str]] = None) -> List[Dict[str, Any]]:
         """Execute the same prompt across multiple models in parallel"""
         print(f"\n🚀 Parallel Execution: {len(models)} models")
         print(f"📝 Prompt: {prompt[:100]}...")
         print()
         
-        with concurrent.futures.ThreadPoolExecutor(max_workers=len(models)) as executor:
-            futures = {
-                executor.submit(self.run_model, model, prompt, timeout): model 
-                for model in models
-            }
-            
-            results = []
-            for future in concurrent.futures.as_completed(futures):
-                model = futures[future]
+        async def run_all() -> List[Dict[str, Any]]:
+            async def run_one(model: str) -> Dict[str, Any]:
                 try:
-                    result = future.result()
-                    results.append(result)
-                    
-                    status = "✓" if result["success"] else "✗"
-                    print(f"{status} {model} completed")
-                    
+                    result = await self.run_model_async(model, prompt, timeout, cache_files)
                 except Exception as e:
                     print(f"✗ {model} failed: {e}")
-                    results.append({
-                        "model": model,
-                        "success": False,
-                        "error": str(e),
-                        "output": None,
-                        "timestamp": datetime.now().isoformat()
-                    })
+                    return self._failure(model, str(e))
+                
+                status = "✓" if result["success"] else "✗"
+                print(f"{status} {model} completed")
+                return result
+            
+            return list(await asyncio.gather(*(run_one(model) for model in models)))
         
-        return results
+        return asyncio.run(run_all())
     
-    def sequential_execution(self, workflow: List[Dict[str, str]]) -> List[Dict[str, Any]]:
-        """Execute a workflow where each step uses output from previous step"""
+    def sequential_execution(self, workflow: List[Dict[str, Any]],
+                             on_line: Optional[Callable[[str, str, str], None]] = None,
+                             run_id: Optional[str] = None, resume: bool = False) -> List[Dict[str, Any]]:
+        """Execute a workflow where each step uses output from previous step
+
+        Steps name a "model" or a "task" to route (see `step_models`).
+        A step may set "until" (a predicate on its output so far) or
+        "min_context_chars" to hand its output to the next step as soon as
+        enough has arrived instead of waiting for the model to finish.
+
+        With a `run_id` every step is checkpointed (see `run_step_async`);
+        `resume` skips steps that already succeeded with the same inputs.
+        """
         print(f"\n🔄 Sequential Execution: {len(workflow)} steps")
+        if run_id:
+            print(f"🆔 Run: {run_id}{' (resuming)' if resume else ''}")
         print()
         
         results = []
         context = ""
         
         for i, step in enumerate(workflow, 1):
-            model = step["model"]
+            model, *backups = self.step_models(step)
             prompt_template = step["prompt"]
             
-            # Insert context from previous step
-            prompt = prompt_template.format(context=context)
+            # Insert context from previous step, summarised if it would overflow the budget
+            prompt = render_prompt(prompt_template, self.prompts.fit_sections(prompt_template, {"context": context}))
             
-            print(f"Step {i}/{len(workflow)}: {model}")
+            hedge = f" (hedge: {', '.join(backups)})" if backups else ""
+            print(f"Step {i}/{len(workflow)}: {model}{hedge}")
             print(f"  Prompt: {prompt[:80]}...")
             
-            result = self.run_model(model, prompt)
+            until = step.get("until")
+            if until is None and step.get("min_context_chars"):
+                until = step["min_context_chars"]
+            
+            result = asyncio.run(self.run_step_async(
+                run_id, step.get("name", f"step_{i}"), model, prompt,
+                step.get("timeout", 120), step.get("cache_files"), resume, backups,
+                on_line=on_line, until=until
+            ))
             results.append(result)
             
             if result["success"]:
                 context = result["output"]
-                print(f"  ✓ Success ({len(context)} chars output)")
+                early = " (stopped early)" if result.get("partial") else ""
+                first = result.get("first_output_s")
+                first = f", first output after {first:.1f}s" if first is not None else ""
+                winner = f" from {result['model']}" if backups else ""
+                print(f"  ✓ Success{winner} ({len(context)} chars output{first}){early}")
             else:
                 print(f"  ✗ Failed: {result['error']}")
                 break
@@ -160,12 +1390,100 @@ class AICoordinator:
         
         return results
     
-    def consensus_execution(self, models: List[str], prompt: str, timeout: int = 120) -> Dict[str, Any]:
+    async def dag_execution_async(self, steps: List[Dict[str, Any]], timeout: int = 120,
+                                  run_id: Optional[str] = None, resume: bool = False) -> Dict[str, Any]:
+        """Run a workflow DAG, starting every step as soon as its dependencies finish.
+
+        Each step is {"name", "model" or "task", "prompt"} (see
+        `step_models`) with optional "depends_on"
+        (upstream step names), "timeout", "cache_files" and "until". Prompts
+        may use `{context}` and `{upstream_name}` placeholders. Steps whose
+        upstream failed are skipped. Concurrency is bounded by the engine's
+        global limit. With a `run_id` steps are checkpointed, and `resume`
+        reuses those that already succeeded with the same inputs.
+        """
+        order = topological_order(steps)
+        by_name = {step["name"]: step for step in steps}
+        
+        print(f"\n🕸️ DAG Execution: {len(steps)} steps")
+        if run_id:
+            print(f"🆔 Run: {run_id}{' (resuming)' if resume else ''}")
+        print()
+        
+        dag_start = time.perf_counter()
+        tasks: Dict[str, asyncio.Future] = {}
+        results: Dict[str, Dict[str, Any]] = {}
+        timings: Dict[str, tuple] = {}
+        
+        async def run_step(step: Dict[str, Any]):
+            deps = step.get("depends_on", [])
+            if deps:
+                await asyncio.gather(*(tasks[dep] for dep in deps))
+            
+            start = time.perf_counter() - dag_start
+            # Routed when the step starts, so it sees the latency of steps that already ran
+            model, *backups = self.step_models(step)
+            failed = [dep for dep in deps if not results[dep]["success"]]
+            if failed:
+                result = self._failure(model, f"Skipped: upstream step(s) failed: {', '.join(failed)}")
+                result["skipped"] = True
+            else:
+                upstream = {dep: results[dep]["output"] for dep in deps}
+                prompt = render_prompt(step["prompt"], self.prompts.fit_sections(step["prompt"], upstream))
+                result = await self.run_step_async(
+                    run_id, step["name"], model, prompt, step.get("timeout", timeout),
+                    step.get("cache_files"), resume, backups, until=step.get("until")
+                )
+            end = time.perf_counter() - dag_start
+            
+            result["step"] = step["name"]
+            results[step["name"]] = result
+            timings[step["name"]] = (start, end)
+            status = "✓" if result["success"] else "✗"
+            print(f"{status} {step['name']} ({result['model']}) done at +{end:.1f}s, took {end - start:.1f}s")
+        
+        for name in order:
+            tasks[name] = asyncio.ensure_future(run_step(by_name[name]))
+        await asyncio.gather(*tasks.values())
+        
+        wall = time.perf_counter() - dag_start
+        path = critical_path(steps, timings)
+        path_time = sum(timings[name][1] - timings[name][0] for name in path)
+        serial = sum(end - start for start, end in timings.values())
+        
+        print(f"\n📈 Critical path: {path_time:.1f}s of {wall:.1f}s wall time ({serial:.1f}s if run one by one)")
+        print("   " + " → ".join(
+            f"{name} ({timings[name][1] - timings[name][0]:.1f}s)" for name in path
+        ))
+        
+        return {
+            "run_id": run_id,
+            "steps": [results[name] for name in order],
+            "critical_path": path,
+            "critical_path_s": round(path_time, 3),
+            "wall_time_s": round(wall, 3),
+            "serial_time_s": round(serial, 3),
+            "timings": {name: {"start_s": round(start, 3), "end_s": round(end, 3)}
+                        for name, (start, end) in timings.items()},
+            "timestamp": datetime.now().isoformat()
+        }
+    
+    def dag_execution(self, steps: List[Dict[str, Any]], timeout: int = 120,
+                      run_id: Optional[str] = None, resume: bool = False) -> Dict[str, Any]:
+        """Blocking wrapper around `dag_execution_async`"""
+        return asyncio.run(self.dag_execution_async(steps, timeout, run_id, resume))
+    
+    def consensus_execution(self, models: List[str], prompt: str, timeout: int = 120,
+                            cache_files: Optional[List[str]] = None) -> Dict[str, Any]:
         """Get consensus from multiple models"""
         print(f"\n🤝 Consensus Execution: {len(models)} models")
         print()
         
-        results = self.parallel_execution(models, prompt, timeout)
+        results = self.parallel_execution(models, prompt, timeout, cache_files)
+        return self.build_consensus(models, prompt, results)
+    
+    def build_consensus(self, models: List[str], prompt: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Consensus report over results already collected (e.g. by a DAG run)"""
         successful_results = [r for r in results if r["success"]]
         
         consensus = {
@@ -181,31 +1499,86 @@ class AICoordinator:
         
         return consensus
     
-    def _analyze_consensus(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """Analyze consensus from multiple model outputs"""
+    def _analyze_consensus(self, results: List[Dict[str, Any]], max_ngram: int = 3,
+                           min_coverage: float = 0.5, tfidf: bool = False,
+                           top_n: int = 20) -> Dict[str, Any]:
+        """Analyze consensus from multiple model outputs
+
+        Each output is tokenized once into stopword-free phrases, and the
+        words and n-grams (up to `max_ngram` words) inside them are counted,
+        so the cost is linear in total output size. A theme is a term found
+        in at least `min_coverage` of the outputs, and always in at least two
+        of them. Agreement is the mean share of each output's words that are
+        themes, so long outputs do not look agreed just by sharing a few
+        words. Themes are ranked by how
+        many outputs share them, then by phrase length and total mentions.
+        With `tfidf`, length-normalised term frequency times smoothed inverse
+        document frequency is used instead; this favours terms that some
+        models stress heavily over boilerplate every model repeats.
+        """
         if not results:
             return {"agreement": "none", "summary": "All models failed"}
         
-        # Simple analysis - in a real system, this would use NLP to find common themes
-        outputs = [r["output"] for r in results]
+        doc_counts = [term_counts(r["output"] or "", max_ngram) for r in results]
+        document_frequency: Counter = Counter()
+        total_counts: Counter = Counter()
+        for counts in doc_counts:
+            document_frequency.update(counts.keys())
+            total_counts.update(counts)
         
-        # Check for common keywords
-        all_words = set()
-        for output in outputs:
-            words = output.lower().split() if output else []
-            all_words.update(words)
+        n_docs = len(results)
+        min_docs = max(2, math.ceil(n_docs * min_coverage)) if n_docs > 1 else 1
+        themes = [term for term, df in document_frequency.items() if df >= min_docs]
         
-        common_words = []
-        for word in all_words:
-            count = sum(1 for output in outputs if output and word in output.lower())
-            if count >= len(results) * 0.5:  # Present in 50%+ of outputs
-                common_words.append(word)
+        overlap = None
+        if n_docs > 1:
+            shares = []
+            for counts in doc_counts:
+                words = [term for term in counts if " " not in term]
+                shared = sum(1 for word in words if document_frequency[word] >= min_docs)
+                shares.append(shared / len(words) if words else 0.0)
+            overlap = sum(shares) / n_docs
+        
+        scores: Dict[str, float] = {}
+        if tfidf:
+            doc_lengths = [max(1, sum(counts.values())) for counts in doc_counts]
+            for term in themes:
+                idf = math.log((1 + n_docs) / (1 + document_frequency[term])) + 1
+                tf = sum(counts[term] / length for counts, length in zip(doc_counts, doc_lengths))
+                scores[term] = tf * idf
+            themes.sort(key=lambda term: scores[term], reverse=True)
+        else:
+            themes.sort(
+                key=lambda term: (document_frequency[term], term.count(" "), total_counts[term]),
+                reverse=True
+            )
+        
+        ranked = [
+            {
+                "term": term,
+                "words": len(term.split()),
+                "documents": document_frequency[term],
+                "coverage": round(document_frequency[term] / n_docs, 3),
+                "mentions": total_counts[term],
+                "score": round(scores[term], 6) if tfidf else None
+            }
+            for term in themes[:top_n]
+        ]
         
         return {
-            "agreement": "high" if len(common_words) > 10 else "moderate" if len(common_words) > 5 else "low",
-            "common_themes": common_words[:20],  # Top 20 common words
-            "model_count": len(results),
-            "summary": f"Found {len(common_words)} common themes across {len(results)} models"
+            "agreement": (
+                "single" if overlap is None
+                else next(label for floor, label in AGREEMENT_LEVELS if overlap >= floor)
+            ),
+            "overlap": round(overlap, 3) if overlap is not None else None,
+            "common_themes": [theme["term"] for theme in ranked],
+            "ranked_themes": ranked,
+            "model_count": n_docs,
+            "ranking": "tfidf" if tfidf else "coverage",
+            "summary": (
+                f"Found {len(themes)} common themes across {n_docs} models"
+                + (f" ({overlap:.0%} word overlap)" if overlap is not None else "")
+            )
         }
     
     def save_results(self, results: Any, filename: str):
@@ -218,44 +1591,152 @@ class AICoordinator:
         print(f"\n💾 Results saved to: {filepath}")
         return filepath
     
-    def debate_mode(self, models: List[str], topic: str, rounds: int = 2) -> List[Dict[str, Any]]:
-        """Models debate a topic, responding to each other"""
-        print(f"\n💬 Debate Mode: {len(models)} models, {rounds} rounds")
+    def debate_mode(self, models: List[str], topic: str, rounds: int = 2, parallel: bool = False,
+                    timeout: int = 120, round_timeout: Optional[float] = None,
+                    converge_at: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Models debate a topic, responding to each other
+
+        By default models take turns and also see earlier answers from the
+        same round. With `parallel=True` every model in a round runs at once
+        against a frozen snapshot of the previous round's arguments, so a
+        round costs one model latency. Models still running when
+        `round_timeout` expires are cancelled (their process trees killed)
+        and count as failed for that round.
+
+        Every round runs unless `converge_at` is set (e.g. 0.9): the debate
+        then ends early once positions converge, meaning every model answered
+        the round and the answers are at least `converge_at` similar to each
+        other, or every model's answer is that similar to its previous one.
+        """
+        mode = "parallel" if parallel else "turn-based"
+        print(f"\n💬 Debate Mode: {len(models)} models, {rounds} rounds ({mode})")
         print(f"📋 Topic: {topic}")
         print()
         
         debate_history = []
         context = f"Topic: {topic}\n\nPlease provide your initial position on this topic."
+        # Latest argument and rolling summary of earlier rounds, per model
+        latest: Dict[str, str] = {}
+        earlier: Dict[str, str] = {}
         
         for round_num in range(1, rounds + 1):
             print(f"\n--- Round {round_num} ---")
+            previous = dict(latest)
             
-            for model in models:
-                # Add previous arguments to context
-                if debate_history:
-                    other_args = "\n\n".join([
-                        f"{r['model']}: {r['output'][:200]}..." 
-                        for r in debate_history[-len(models):]
-                        if r['model'] != model
-                    ])
-                    prompt = f"{context}\n\nPrevious arguments:\n{other_args}\n\nYour response:"
-                else:
-                    prompt = context
-                
-                result = self.run_model(model, prompt)
+            if parallel:
+                round_results = asyncio.run(
+                    self._debate_round_async(models, context, latest, earlier, timeout, round_timeout)
+                )
+            else:
+                round_results = []
+                for model in models:
+                    prompt = self._debate_prompt(context, model, latest, earlier)
+                    result = self.run_model(model, prompt, timeout)
+                    if result["success"]:
+                        self._record_argument(model, result["output"], latest, earlier, len(models))
+                    round_results.append((model, prompt, result))
+            
+            answers = {}
+            for model, prompt, result in round_results:
+                result["round"] = round_num
                 debate_history.append(result)
-                
                 if result["success"]:
-                    print(f"  ✓ {model} responded")
+                    answers[model] = result["output"]
+                    if parallel:
+                        self._record_argument(model, result["output"], latest, earlier, len(models))
+                    print(f"  ✓ {model} responded ({self.prompts.estimate_tokens(prompt)} prompt tokens)")
                 else:
-                    print(f"  ✗ {model} failed")
+                    print(f"  ✗ {model} failed: {result['error']}")
+            
+            if converge_at is not None and round_num < rounds and self._debate_converged(
+                models, answers, previous, converge_at
+            ):
+                print(f"\n🤝 Positions converged after round {round_num}, ending debate early")
+                break
         
         return debate_history
+    
+    async def _debate_round_async(self, models: List[str], context: str, latest: Dict[str, str],
+                                  earlier: Dict[str, str], timeout: int,
+                                  round_timeout: Optional[float]) -> List[tuple]:
+        """Run one round concurrently; prompts are built before any model answers"""
+        prompts = {model: self._debate_prompt(context, model, latest, earlier) for model in models}
+        tasks = {
+            model: asyncio.ensure_future(self.run_model_async(model, prompts[model], timeout))
+            for model in models
+        }
+        _, pending = await asyncio.wait(tasks.values(), timeout=round_timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        
+        round_results = []
+        for model, task in tasks.items():
+            if task in pending:
+                result = self._failure(model, f"Round timeout after {round_timeout} seconds")
+            elif task.exception() is not None:
+                result = self._failure(model, str(task.exception()))
+            else:
+                result = task.result()
+            round_results.append((model, prompts[model], result))
+        return round_results
+    
+    def _debate_converged(self, models: List[str], answers: Dict[str, str], previous: Dict[str, str],
+                          converge_at: float) -> bool:
+        """True when this round's answers agree with each other or no model moved since its last answer.
+
+        Never true while a participant failed or timed out this round, so it still gets its turn.
+        """
+        if len(answers) < 2 or len(answers) < len(models):
+            return False
+        names = list(answers)
+        pairs = [(a, b) for i, a in enumerate(names) for b in names[i + 1:]]
+        agreement = sum(position_similarity(answers[a], answers[b]) for a, b in pairs) / len(pairs)
+        
+        stable = None
+        if all(model in previous for model in names):
+            stable = min(position_similarity(answers[model], previous[model]) for model in names)
+        
+        stability = f", least stable model {stable:.2f}" if stable is not None else ""
+        print(f"  📏 Agreement {agreement:.2f}{stability} (converge at {converge_at:.2f})")
+        return agreement >= converge_at or (stable is not None and stable >= converge_at)
+    
+    def _debate_prompt(self, context: str, model: str, latest: Dict[str, str], earlier: Dict[str, str]) -> str:
+        """Debate prompt with the other models' arguments fitted to the prompt budget"""
+        sections = {}
+        for other, argument in latest.items():
+            if other == model:
+                continue
+            if earlier.get(other):
+                sections[f"{other} (earlier rounds, summarised)"] = earlier[other]
+            sections[other] = argument
+        if not sections:
+            return context
+        
+        template = f"{context}\n\nPrevious arguments:\n\nYour response:"
+        # Models often restate the topic and each other; send each point once
+        sections = self.prompts.dedupe(sections, self.prompts.sentence_keys(context))
+        fitted = self.prompts.fit_sections(template, sections)
+        other_args = "\n\n".join(f"{name}: {text}" for name, text in fitted.items() if text)
+        return f"{context}\n\nPrevious arguments:\n{other_args}\n\nYour response:"
+    
+    def _record_argument(self, model: str, output: str, latest: Dict[str, str], earlier: Dict[str, str],
+                         participants: int):
+        """Fold the model's previous argument into its rolling summary and keep the new one"""
+        if model in latest:
+            share = max(100, self.prompts.max_tokens // (3 * max(1, participants - 1)))
+            combined = f"{earlier.get(model, '')}\n{latest[model]}".strip()
+            earlier[model] = self.prompts.summarize(combined, share)
+        latest[model] = output
 
 def main():
-    """Example usage"""
+    """Example usage; `ai_coordinator.py metrics [DAYS]` prints the call metrics summary instead"""
     coordinator = AICoordinator()
     
+    if len(sys.argv) > 1 and sys.argv[1] == "metrics":
+        coordinator.print_metrics_summary(float(sys.argv[2]) if len(sys.argv) > 2 else None)
+        return
+    
     print("=== AI Multi-Model Coordinator ===")
     print()
     
@@ -7,8 +7,20 @@ Specific AI orchestration workflows for fwber project development
 from ai_coordinator import AICoordinator
 from datetime import datetime
 from pathlib import Path
+from typing import List, Dict, Any
+import functools
 import json
 
+
+def _tracked(method):
+    """Record the model calls made by a workflow under its method name in the coordinator metrics"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.coordinator.workflow(method.__name__):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class fwberWorkflows:
     """Pre-configured workflows for fwber development"""
     
@@ -17,14 +29,31 @@ class fwberWorkflows:
         self.workflows_dir = Path("AI_COORDINATION/fwber_workflows")
         self.workflows_dir.mkdir(parents=True, exist_ok=True)
     
-    def security_audit(self):
-        """Multi-model security audit of fwber"""
-        print("🔒 fwber Security Audit")
-        print("=" * 60)
-        
-        workflow = [
+    def _run_id(self, workflow: str, resume: bool) -> str:
+        """Latest checkpointed run of `workflow` when resuming, otherwise a fresh run id"""
+        if resume:
+            run_id = self.coordinator.latest_run_id(workflow)
+            if run_id:
+                return run_id
+            print(f"No previous {workflow} run to resume, starting a new one")
+        return self.coordinator.new_run_id(workflow)
+    
+    @staticmethod
+    def _chain(prefix: str, workflow: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Turn a sequential workflow into DAG steps named prefix_1, prefix_2, ..."""
+        steps = []
+        for i, step in enumerate(workflow, 1):
+            steps.append({
+                **step,
+                "name": f"{prefix}_{i}",
+                "depends_on": [f"{prefix}_{i - 1}"] if i > 1 else []
+            })
+        return steps
+    
+    def _security_audit_steps(self) -> List[Dict[str, Any]]:
+        return [
             {
-                "model": "codex",
+                "task": ["coding", "debugging"],
                 "prompt": """Analyze the fwber PHP codebase for security vulnerabilities.
                 Focus on:
                 1. SQL injection risks
@@ -33,10 +62,11 @@ class fwberWorkflows:
                 4. File upload security
                 5. Session management
                 
-                List the top 5 most critical security concerns."""
+                List the top 5 most critical security concerns.""",
+                "cache_files": ["*.php"]
             },
             {
-                "model": "claude",
+                "task": ["analysis"],
                 "prompt": """Based on this security analysis, provide detailed remediation steps
                 for each identified vulnerability:
                 
@@ -49,8 +79,18 @@ class fwberWorkflows:
                 - Prevention best practices"""
             }
         ]
+    
+    @_tracked
+    def security_audit(self, resume: bool = False):
+        """Multi-model security audit of fwber (resume=True reuses successful steps of the last run)"""
+        print("🔒 fwber Security Audit")
+        print("=" * 60)
         
-        results = self.coordinator.sequential_execution(workflow)
+        results = self.coordinator.sequential_execution(
+            self._security_audit_steps(),
+            run_id=self._run_id("security_audit", resume),
+            resume=resume
+        )
         filepath = self.coordinator.save_results(
             results, 
             f"security_audit_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -59,12 +99,13 @@ class fwberWorkflows:
         print(f"\n✅ Security audit complete")
         return results
     
-    def matching_algorithm_optimization(self):
+    @_tracked
+    def matching_algorithm_optimization(self, resume: bool = False):
         """Optimize the fwber matching algorithm"""
         print("🎯 Matching Algorithm Optimization")
         print("=" * 60)
         
-        # Parallel analysis
+        models = self.coordinator.route(["coding", "analysis"], count=2)
         prompt = """Analyze the fwber matching algorithm (MatchingEngine.php).
         Suggest 3 specific optimizations to:
         1. Improve match quality
@@ -72,22 +113,30 @@ class fwberWorkflows:
         3. Add new matching criteria
         
         Provide concrete code examples."""
+        consensus_prompt = "What are the most important improvements for a dating app matching algorithm?"
         
-        results = self.coordinator.parallel_execution(
-            ["codex", "claude"], 
-            prompt,
-            timeout=120
-        )
-        
-        # Get consensus on best optimizations
-        consensus = self.coordinator.consensus_execution(
-            ["codex", "claude"],
-            "What are the most important improvements for a dating app matching algorithm?"
+        # The code analysis and the consensus question are independent, so all
+        # four calls run at once
+        steps = [
+            {"name": f"analysis_{model}", "model": model, "prompt": prompt,
+             "cache_files": ["*MatchingEngine.php"]}
+            for model in models
+        ] + [
+            {"name": f"consensus_{model}", "model": model, "prompt": consensus_prompt}
+            for model in models
+        ]
+        dag = self.coordinator.dag_execution(
+            steps, timeout=120, run_id=self._run_id("matching_optimization", resume), resume=resume
         )
+        by_step = {result["step"]: result for result in dag["steps"]}
         
         combined_results = {
-            "analysis": results,
-            "consensus": consensus,
+            "analysis": [by_step[f"analysis_{model}"] for model in models],
+            "consensus": self.coordinator.build_consensus(
+                models, consensus_prompt, [by_step[f"consensus_{model}"] for model in models]
+            ),
+            "critical_path": dag["critical_path"],
+            "wall_time_s": dag["wall_time_s"],
             "timestamp": datetime.now().isoformat()
         }
         
@@ -99,14 +148,10 @@ class fwberWorkflows:
         print(f"\n✅ Matching optimization analysis complete")
         return combined_results
     
-    def database_schema_review(self):
-        """Review and optimize database schema"""
-        print("🗄️ Database Schema Review")
-        print("=" * 60)
-        
-        workflow = [
+    def _database_review_steps(self) -> List[Dict[str, Any]]:
+        return [
             {
-                "model": "claude",
+                "task": ["analysis", "architecture"],
                 "prompt": """Review the fwber database setup files (setup-database.sql).
                 Analyze:
                 1. Table structure and relationships
@@ -114,10 +159,11 @@ class fwberWorkflows:
                 3. Data types and constraints
                 4. Scalability concerns
                 
-                Provide a comprehensive analysis."""
+                Provide a comprehensive analysis.""",
+                "cache_files": ["*setup-database.sql"]
             },
             {
-                "model": "codex",
+                "task": ["coding", "refactoring"],
                 "prompt": """Based on this database analysis:
                 
                 {context}
@@ -131,8 +177,18 @@ class fwberWorkflows:
                 Provide the complete SQL migration script."""
             }
         ]
+    
+    @_tracked
+    def database_schema_review(self, resume: bool = False):
+        """Review and optimize database schema"""
+        print("🗄️ Database Schema Review")
+        print("=" * 60)
         
-        results = self.coordinator.sequential_execution(workflow)
+        results = self.coordinator.sequential_execution(
+            self._database_review_steps(),
+            run_id=self._run_id("database_review", resume),
+            resume=resume
+        )
         filepath = self.coordinator.save_results(
             results,
             f"database_review_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -141,6 +197,7 @@ class fwberWorkflows:
         print(f"\n✅ Database schema review complete")
         return results
     
+    @_tracked
     def feature_implementation_debate(self, feature_description: str):
         """Debate the best approach for implementing a new feature"""
         print(f"💭 Feature Implementation Debate")
@@ -157,9 +214,11 @@ class fwberWorkflows:
         - User experience"""
         
         debate_results = self.coordinator.debate_mode(
-            ["codex", "claude"],
+            self.coordinator.route(["architecture", "analysis", "coding"], count=2),
             topic,
-            rounds=2
+            rounds=2,
+            parallel=True,
+            converge_at=0.9
         )
         
         filepath = self.coordinator.save_results(
@@ -170,6 +229,7 @@ class fwberWorkflows:
         print(f"\n✅ Feature debate complete")
         return debate_results
     
+    @_tracked
     def code_review_parallel(self, file_pattern: str = "*.php"):
         """Parallel code review of specific files"""
         print(f"📝 Parallel Code Review: {file_pattern}")
@@ -185,9 +245,10 @@ class fwberWorkflows:
         Prioritize the most critical issues."""
         
         results = self.coordinator.parallel_execution(
-            ["codex", "claude"],
+            self.coordinator.route(["coding", "debugging"], count=2),
             prompt,
-            timeout=180
+            timeout=180,
+            cache_files=[file_pattern]
         )
         
         filepath = self.coordinator.save_results(
@@ -198,24 +259,21 @@ class fwberWorkflows:
         print(f"\n✅ Code review complete")
         return results
     
-    def mvp_validation(self):
-        """Validate fwber MVP implementation"""
-        print("✨ MVP Validation")
-        print("=" * 60)
-        
-        workflow = [
+    def _mvp_validation_steps(self) -> List[Dict[str, Any]]:
+        return [
             {
-                "model": "claude",
+                "task": ["analysis"],
                 "prompt": """Review the fwber MVP specification (B2B_MVP_SPEC.md).
                 Check current implementation against the spec:
                 1. Which features are implemented?
                 2. Which features are missing?
                 3. Which features need improvement?
                 
-                Provide a detailed gap analysis."""
+                Provide a detailed gap analysis.""",
+                "cache_files": ["*B2B_MVP_SPEC.md"]
             },
             {
-                "model": "codex",
+                "task": ["coding"],
                 "prompt": """Based on this MVP gap analysis:
                 
                 {context}
@@ -233,8 +291,18 @@ class fwberWorkflows:
                 Provide the complete prioritized roadmap."""
             }
         ]
+    
+    @_tracked
+    def mvp_validation(self, resume: bool = False):
+        """Validate fwber MVP implementation"""
+        print("✨ MVP Validation")
+        print("=" * 60)
         
-        results = self.coordinator.sequential_execution(workflow)
+        results = self.coordinator.sequential_execution(
+            self._mvp_validation_steps(),
+            run_id=self._run_id("mvp_validation", resume),
+            resume=resume
+        )
         filepath = self.coordinator.save_results(
             results,
             f"mvp_validation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
@@ -243,7 +311,34 @@ class fwberWorkflows:
         print(f"\n✅ MVP validation complete")
         return results
     
-    def documentation_generation(self):
+    @_tracked
+    def full_audit(self, resume: bool = False):
+        """Security, database and MVP reviews as one DAG.
+
+        The three two-step chains are independent, so the audit takes as long
+        as its slowest chain rather than the sum of all six calls.
+        """
+        print("🧭 Full Audit (security + database + MVP)")
+        print("=" * 60)
+        
+        steps = (
+            self._chain("security", self._security_audit_steps())
+            + self._chain("database", self._database_review_steps())
+            + self._chain("mvp", self._mvp_validation_steps())
+        )
+        results = self.coordinator.dag_execution(
+            steps, timeout=180, run_id=self._run_id("full_audit", resume), resume=resume
+        )
+        filepath = self.coordinator.save_results(
+            results,
+            f"full_audit_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+        
+        print(f"\n✅ Full audit complete")
+        return results
+    
+    @_tracked
+    def documentation_generation(self, resume: bool = False):
         """Generate comprehensive documentation"""
         print("📚 Documentation Generation")
         print("=" * 60)
@@ -254,15 +349,20 @@ class fwberWorkflows:
             ("Developer Guide", "Write a developer setup guide for fwber")
         ]
         
-        all_results = []
+        # The documents are independent: generate them concurrently, each one
+        # checkpointed so a resumed run only redoes the ones that failed
+        steps = [
+            {"name": doc_type.lower().replace(" ", "_"), "task": ["documentation"], "prompt": prompt}
+            for doc_type, prompt in tasks
+        ]
+        dag = self.coordinator.dag_execution(
+            steps, timeout=120, run_id=self._run_id("documentation", resume), resume=resume
+        )
         
-        for doc_type, prompt in tasks:
-            print(f"\n📄 Generating: {doc_type}")
-            result = self.coordinator.run_model("claude", prompt, timeout=120)
-            all_results.append({
-                "type": doc_type,
-                "result": result
-            })
+        all_results = [
+            {"type": doc_type, "result": result}
+            for (doc_type, _), result in zip(tasks, dag["steps"])
+        ]
         
         filepath = self.coordinator.save_results(
             all_results,
@@ -285,6 +385,7 @@ def main():
     print("4. MVP Validation")
     print("5. Code Review")
     print("6. Documentation Generation")
+    print("7. Full Audit (security + database + MVP in parallel)")
     print()
     
     # Example: Run security audit
@@ -305,6 +406,9 @@ def main():
     print("  workflows.mvp_validation()")
     print("  workflows.code_review_parallel('*.php')")
     print("  workflows.documentation_generation()")
+    print("  workflows.full_audit()")
+    print("Pass resume=True to reuse the successful steps of the last run")
+    print("Per-model and per-workflow latency: python ai_coordinator.py metrics [DAYS]")
     print("=" * 60)
 
 if __name__ == "__main__":
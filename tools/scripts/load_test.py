@@ -1,18 +1,41 @@
 import aiohttp
+import argparse
 import asyncio
+import csv
+import functools
+import gzip
+import heapq
 import random
 import json
+import math
+import multiprocessing
 import time
 import os
+import queue
+import re
+import socket
+import string
 import sys
+import zlib
 from datetime import datetime
+from urllib.parse import urlsplit
 
 # --- Configuration ---
 # API Base URL - Default to localhost for testing, but can be overridden
+# with --base-url
 BASE_URL = os.environ.get("API_BASE_URL", "http://localhost:8000/api")
 EMAIL = os.environ.get("TEST_USER_EMAIL", "test@example.com")
 PASSWORD = os.environ.get("TEST_USER_PASSWORD", "password")
 
+# Per-user accounts: a CSV/JSONL credentials file or a seeded email pattern
+# such as "loadtest+{n}@example.com" (all sharing TEST_USER_PASSWORD)
+CREDENTIALS_FILE = os.environ.get("CREDENTIALS_FILE")
+EMAIL_PATTERN = os.environ.get("TEST_USER_EMAIL_PATTERN")
+LOGIN_CONCURRENCY = int(os.environ.get("LOGIN_CONCURRENCY", 20))
+TOKEN_CACHE = os.environ.get("TOKEN_CACHE", ".load_test_tokens.json")
+# Seconds a cached token is reused before logging in again (0 = until rejected)
+TOKEN_TTL = float(os.environ.get("TOKEN_TTL", 12 * 3600))
+
 # Number of concurrent users to simulate
 CONCURRENT_USERS = int(os.environ.get("CONCURRENT_USERS", 5))
 
@@ -22,7 +45,92 @@ DURATION = int(os.environ.get("TEST_DURATION", 60))
 # Request delay range (min, max) in seconds
 DELAY_RANGE = (0.5, 3.0)
 
-# Endpoints and their weights (higher weight = more frequent)
+# Optional scenario file (JSON, or YAML with PyYAML) replacing ENDPOINTS
+SCENARIO_FILE = os.environ.get("LOAD_SCENARIO")
+
+# Load model: "closed" (virtual users wait for each response, then think),
+# "open" (requests are sent on an arrival schedule regardless of responses)
+# or "replay" (requests and their timing come from a recorded access log)
+LOAD_MODE = os.environ.get("LOAD_MODE", "closed")
+
+# Open-loop target request rate and arrival process ("poisson" or "fixed")
+TARGET_RPS = float(os.environ.get("TARGET_RPS", 20))
+ARRIVAL = os.environ.get("ARRIVAL", "poisson")
+
+# Open-loop cap on outstanding requests; sends beyond it are counted as missed
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", 1000))
+
+# Replay mode: access log (nginx "combined" format or JSONL, optionally .gz),
+# time compression factor, methods replayed, paths skipped and an optional
+# JSON file mapping logged users to test account emails
+REPLAY_FILE = os.environ.get("LOAD_REPLAY_FILE")
+REPLAY_SPEED = float(os.environ.get("LOAD_REPLAY_SPEED", 1.0))
+REPLAY_METHODS = os.environ.get("LOAD_REPLAY_METHODS", "GET,HEAD")
+REPLAY_EXCLUDE = os.environ.get("LOAD_REPLAY_EXCLUDE", r"/auth/|/broadcasting/")
+REPLAY_USER_MAP = os.environ.get("LOAD_REPLAY_USER_MAP")
+
+# Generator processes; each runs its own event loop and HTTP session
+WORKERS = int(os.environ.get("LOAD_WORKERS", 1))
+
+# HTTP connection pool: total connections, per-host limit (0 = unlimited),
+# DNS cache TTL in seconds (0 disables the cache) and idle keep-alive timeout.
+# FORCE_CLOSE opens a fresh connection for every request (no keep-alive).
+POOL_SIZE = int(os.environ.get("POOL_SIZE", 100))
+LIMIT_PER_HOST = int(os.environ.get("LIMIT_PER_HOST", 0))
+DNS_TTL = int(os.environ.get("DNS_TTL", 10))
+KEEPALIVE_TIMEOUT = float(os.environ.get("KEEPALIVE_TIMEOUT", 15))
+FORCE_CLOSE = os.environ.get("FORCE_CLOSE", "0").lower() in ("1", "true", "yes")
+
+# Live metrics: seconds between interval lines (0 disables) and an optional
+# JSONL file that receives one row per interval
+LIVE_INTERVAL = float(os.environ.get("LIVE_INTERVAL", 10))
+LIVE_JSONL = os.environ.get("LIVE_JSONL")
+
+# Optional path for the machine-readable result artifact (see `compare`)
+RESULTS_JSON = os.environ.get("LOAD_RESULTS_JSON")
+
+# Websocket mode: Reverb (Pusher protocol) endpoint and app key, as used by
+# ops/hetzner/scripts/smoke-check.sh, plus the channels every connection joins.
+# Channel names are templates over {user_id}, {email} and {account}; private-
+# and presence- channels are signed through WS_AUTH_URL (default: the API's
+# /broadcasting/auth).
+WS_URL = os.environ.get("FWBER_WS_URL", "ws://localhost:8080")
+REVERB_APP_KEY = os.environ.get("FWBER_REVERB_APP_KEY", "")
+WS_AUTH_URL = os.environ.get("WS_AUTH_URL")
+WS_CHANNELS = [c.strip() for c in os.environ.get("WS_CHANNELS", "presence-online").split(",") if c.strip()]
+WS_CONNECT_RATE = float(os.environ.get("WS_CONNECT_RATE", 200))
+WS_PUBLISHERS = int(os.environ.get("WS_PUBLISHERS", 1))
+WS_PUBLISH_INTERVAL = float(os.environ.get("WS_PUBLISH_INTERVAL", 1.0))
+WS_HANDSHAKE_TIMEOUT = 10
+WS_PING_INTERVAL = 30
+WS_CLIENT_EVENT = "client-load-test"
+
+# Load profile: "constant", or "step"/"ramp" from PROFILE_START to PROFILE_END
+# in PROFILE_STEP increments, one stage per STEP_DURATION seconds. Levels are
+# users in closed-loop mode and req/s in open-loop mode.
+LOAD_PROFILE = os.environ.get("LOAD_PROFILE", "constant")
+PROFILE_START = float(os.environ.get("PROFILE_START", 10))
+PROFILE_END = float(os.environ.get("PROFILE_END", 500))
+PROFILE_STEP = float(os.environ.get("PROFILE_STEP", 50))
+STEP_DURATION = float(os.environ.get("STEP_DURATION", 60))
+
+# Saturation knee: throughput grew by less than this fraction of the load
+# increase while p99 grew by at least this factor over the previous stage
+SATURATION_PLATEAU_RATIO = 0.5
+SATURATION_P99_GROWTH = 1.5
+
+# Fraction of responses to key-only ``expect`` steps that are JSON-decoded for
+# the full structural check; the byte-level key check runs on every one. Steps
+# that extract values or check ``min_items`` are always decoded, and failures
+# found in the sample are scaled up in the error rate.
+VALIDATE_SAMPLE = float(os.environ.get("LOAD_VALIDATE_SAMPLE", "0.05"))
+
+# Open-loop sends starting later than this behind schedule are counted as late
+LATE_SEND_THRESHOLD_MS = 10
+
+# Endpoints and their weights (higher weight = more frequent). Used as the
+# scenario when no --scenario file is given; each endpoint becomes a
+# single-step journey.
 ENDPOINTS = [
     {
         "method": "GET",
@@ -62,157 +170,2620 @@ ENDPOINTS = [
 ]
 
 
-class LoadTester:
+# Number of slowest requests kept (with their X-Request-Id) for log lookup
+SLOWEST_REQUESTS = int(os.environ.get("LOAD_SLOWEST", 20))
+
+# Percentiles shown in the final latency tables
+REPORT_PERCENTILES = (50, 90, 95, 99, 99.9)
+
+
+# Template variables known when a plan is compiled; steps using only these are
+# rendered once at startup. Anything else ({iteration}, extracted values) is
+# rendered per request.
+PLAN_VARIABLES = frozenset(("user_id", "email", "account"))
+
+
+class CompiledStep:
+    """A scenario step with its URL, body and headers pre-built for one account."""
+
+    __slots__ = ("name", "method", "url", "body", "headers", "think_time", "extract", "dynamic", "expect")
+
+
+class ResponseCheck:
+    """Compiled ``expect`` block of a scenario step.
+
+    ``tokens`` are the quoted key names (``b'"matches"'``) searched for in the
+    raw body before any parsing, so a response missing a required key fails
+    without being decoded.
+    """
+
+    __slots__ = ("keys", "tokens", "min_items", "items")
+
+    def __init__(self, keys, min_items, items):
+        self.keys = keys
+        self.min_items = min_items
+        self.items = items
+        self.tokens = [
+            json.dumps(part).encode("utf-8")
+            for part in {
+                next((p for p in reversed(key.split(".")) if not p.isdigit()), None)
+                for key in keys + ([items] if items else [])
+            }
+            if part
+        ]
+
+    def prefilter(self, payload):
+        """Cheap byte-level check; returns a failure reason or None."""
+        if not payload:
+            return "empty-body"
+        for token in self.tokens:
+            if token not in payload:
+                return "missing-key"
+        return None
+
+    def validate(self, document):
+        """Structural check of a decoded body; returns a failure reason or None."""
+        for key in self.keys:
+            if extract_path(document, key) is None:
+                return "missing-key"
+        if self.min_items:
+            items = extract_path(document, self.items) if self.items else document
+            if not isinstance(items, (list, dict)) or len(items) < self.min_items:
+                return "too-few-items"
+        return None
+
+
+class CompiledJourney:
+    __slots__ = ("name", "steps")
+
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = steps
+
+
+class ScenarioPlan:
+    """All journeys of a scenario compiled for one account."""
+
+    def __init__(self, journeys, cum_weights, variables, headers=None, json_headers=None):
+        self.journeys = journeys
+        self.cum_weights = cum_weights
+        self.variables = variables
+        self.headers = headers
+        self.json_headers = json_headers
+
+    def pick_journey(self):
+        """Picks a journey based on weight."""
+        return random.choices(self.journeys, cum_weights=self.cum_weights, k=1)[0]
+
+
+def _think_time(value, default):
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return (float(value), float(value))
+    low, high = value
+    return (float(low), float(high))
+
+
+def _normalize_step(step, default_think):
+    if "url" not in step:
+        raise ValueError(f"Scenario step is missing 'url': {step}")
+    method = step.get("method", "GET").upper()
+    extract = step.get("extract") or {}
+    expect = step.get("expect")
+    if expect is not None:
+        unknown = set(expect) - {"keys", "min_items", "items"}
+        if unknown:
+            raise ValueError(f"Unknown 'expect' fields in step {step['url']}: {sorted(unknown)}")
+        expect = {
+            "keys": [str(key) for key in expect.get("keys") or []],
+            "min_items": int(expect.get("min_items", 0)),
+            "items": expect.get("items"),
+        }
+    return {
+        "name": step.get("name") or f"{method} {step['url']}",
+        "method": method,
+        "url": step["url"],
+        # "data" is accepted for compatibility with ENDPOINTS entries
+        "json": step.get("json", step.get("data")),
+        "think_time": _think_time(step.get("think_time"), default_think),
+        "extract": [(var, path) for var, path in extract.items()],
+        "expect": expect,
+    }
+
+
+def normalize_scenario(raw, name="scenario"):
+    """Validates a scenario document and fills in defaults.
+
+    A scenario has either ``journeys`` (each with ``weight`` and ordered
+    ``steps``) or a flat ``steps`` list whose entries carry their own
+    ``weight`` and become single-step journeys. Steps take ``method``,
+    ``url``, optional ``json`` body, ``think_time`` (seconds or ``[min, max]``)
+    ``extract`` (``{var: "dotted.path"}`` read from the JSON response) and
+    ``expect`` (``keys`` that must be present, ``min_items`` in the list at
+    ``items`` or the body itself); a 2xx response failing ``expect`` counts
+    as an error.
+    URLs and string body values are ``str.format`` templates over
+    ``{user_id}``, ``{email}``, ``{account}``, ``{iteration}`` and extracted
+    variables.
+    """
+    default_think = _think_time(raw.get("think_time"), DELAY_RANGE)
+    if "journeys" in raw:
+        journeys = raw["journeys"]
+    elif "steps" in raw:
+        journeys = [
+            {"name": step.get("name") or step["url"], "weight": step.get("weight", 1), "steps": [step]}
+            for step in raw["steps"]
+        ]
+    else:
+        raise ValueError("Scenario needs a 'journeys' or 'steps' list")
+
+    normalized = []
+    for index, journey in enumerate(journeys):
+        think = _think_time(journey.get("think_time"), default_think)
+        steps = [_normalize_step(step, think) for step in journey.get("steps", [])]
+        if not steps:
+            raise ValueError(f"Journey {journey.get('name', index)} has no steps")
+        weight = float(journey.get("weight", 1))
+        if weight <= 0:
+            continue
+        normalized.append({"name": journey.get("name") or f"journey-{index}", "weight": weight, "steps": steps})
+
+    if not normalized:
+        raise ValueError("Scenario has no journeys with a positive weight")
+    return {"name": raw.get("name", name), "journeys": normalized}
+
+
+def default_scenario():
+    return normalize_scenario({"steps": ENDPOINTS}, name="default")
+
+
+def load_scenario(path):
+    """Loads a JSON or YAML (requires PyYAML) scenario file."""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith((".yml", ".yaml")):
+            try:
+                import yaml
+            except ImportError:
+                raise SystemExit("PyYAML is required for YAML scenarios: pip install pyyaml")
+            raw = yaml.safe_load(f)
+        else:
+            raw = json.load(f)
+    return normalize_scenario(raw, name=os.path.splitext(os.path.basename(path))[0])
+
+
+def template_fields(value):
+    """Names of the ``{placeholders}`` used anywhere in a template value."""
+    if isinstance(value, str):
+        return {
+            field.split(".")[0].split("[")[0]
+            for _, field, _, _ in string.Formatter().parse(value)
+            if field
+        }
+    if isinstance(value, dict):
+        return set().union(*(template_fields(v) for v in value.values()))
+    if isinstance(value, list):
+        return set().union(*(template_fields(v) for v in value))
+    return set()
+
+
+def render_template(value, variables):
+    """Renders string templates inside a JSON-like value.
+
+    A string that is exactly one placeholder (``"{match_id}"``) is replaced by
+    the variable itself so numeric ids stay numbers.
+    """
+    if isinstance(value, str):
+        if value.startswith("{") and value.endswith("}") and value.count("{") == 1:
+            key = value[1:-1]
+            if key in variables:
+                return variables[key]
+        return value.format_map(variables)
+    if isinstance(value, dict):
+        return {k: render_template(v, variables) for k, v in value.items()}
+    if isinstance(value, list):
+        return [render_template(v, variables) for v in value]
+    return value
+
+
+def extract_path(document, path):
+    """Follows a dotted path (``"matches.0.id"``) through decoded JSON."""
+    current = document
+    for part in path.split("."):
+        if isinstance(current, list):
+            try:
+                current = current[int(part)]
+            except (ValueError, IndexError):
+                return None
+        elif isinstance(current, dict):
+            current = current.get(part)
+        else:
+            return None
+        if current is None:
+            return None
+    return current
+
+
+def compile_plan(scenario, identity, account, base_url):
+    """Pre-builds URLs, JSON bodies and headers of every step for one account against ``base_url``.
+
+    Steps that only use plan variables are rendered and serialised here so the
+    request loop just passes ready-made strings, bytes and header dicts.
+    """
+    variables = {"user_id": identity.get("user_id"), "email": identity["email"], "account": account}
+    headers = {
+        "Authorization": f"Bearer {identity['token']}",
+        "Accept": "application/json",
+        "User-Agent": f"LoadTest/1.0 User-{account}",
+    }
+    json_headers = {**headers, "Content-Type": "application/json"}
+
+    journeys = []
+    cum_weights = []
+    total = 0.0
+    for journey in scenario["journeys"]:
+        steps = []
+        for spec in journey["steps"]:
+            step = CompiledStep()
+            step.name = spec["name"]
+            step.method = spec["method"]
+            step.think_time = spec["think_time"]
+            step.extract = spec["extract"]
+            expect = spec["expect"]
+            step.expect = ResponseCheck(expect["keys"], expect["min_items"], expect["items"]) if expect else None
+            step.headers = json_headers if spec["json"] is not None else headers
+            step.dynamic = bool(
+                (template_fields(spec["url"]) | template_fields(spec["json"])) - PLAN_VARIABLES
+            )
+            url = f"{base_url}{spec['url']}"
+            if step.dynamic:
+                step.url = url
+                step.body = spec["json"]
+            else:
+                step.url = url.format_map(variables)
+                step.body = (
+                    json.dumps(render_template(spec["json"], variables)).encode("utf-8")
+                    if spec["json"] is not None
+                    else None
+                )
+            steps.append(step)
+        total += journey["weight"]
+        journeys.append(CompiledJourney(journey["name"], steps))
+        cum_weights.append(total)
+    return ScenarioPlan(journeys, cum_weights, variables, headers, json_headers)
+
+
+# Nginx "combined" format, the default used by the ops/hetzner vhosts:
+# $remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent ...
+NGINX_LINE = re.compile(
+    r'(?P<addr>\S+) \S+ (?P<user>\S+) \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>\S+)[^"]*"'
+)
+
+# Path segments collapsed to {id} when naming replayed routes
+ID_SEGMENT = re.compile(r"^(\d+|[0-9a-fA-F-]{32,36}|[0-9a-fA-F]{24,})$")
+
+
+def open_log(path):
+    """Opens a (possibly gzipped) log for line-by-line reading."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+
+def parse_nginx_log(lines):
+    """Yields request records from nginx access log lines (None for unparsable lines).
+
+    ``$time_local`` only has one-second resolution; ``spread_within_second``
+    restores the spacing inside each second.
+    """
+    last_time = last_ts = None
+    for line in lines:
+        match = NGINX_LINE.match(line)
+        if match is None:
+            yield None
+            continue
+        stamp = match.group("time")
+        if stamp != last_time:
+            try:
+                last_ts = datetime.strptime(stamp, "%d/%b/%Y:%H:%M:%S %z").timestamp()
+            except ValueError:
+                yield None
+                continue
+            last_time = stamp
+        user = match.group("user")
+        yield {
+            "ts": last_ts,
+            "method": match.group("method"),
+            "path": match.group("path"),
+            "client": match.group("addr") if user == "-" else user,
+        }
+
+
+def parse_jsonl_log(lines):
+    """Yields request records from a JSONL log (None for unparsable lines).
+
+    Each line needs ``ts`` (epoch seconds or ISO 8601), ``path`` (or ``url``)
+    and optionally ``method``, ``user`` and a ``json`` body.
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+            ts = row["ts"]
+            if isinstance(ts, str):
+                ts = datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp()
+            yield {
+                "ts": float(ts),
+                "method": str(row.get("method", "GET")).upper(),
+                "path": row.get("path") or row["url"],
+                "client": str(row.get("user") or row.get("user_id") or row.get("ip") or ""),
+                "json": row.get("json"),
+            }
+        except (ValueError, KeyError, TypeError):
+            yield None
+
+
+def spread_within_second(records):
+    """Spaces records sharing a whole-second timestamp evenly across that second.
+
+    Only one second of records is buffered at a time.
+    """
+    bucket = []
+    for record in records:
+        if record is not None and bucket and record["ts"] != bucket[0]["ts"]:
+            step = 1.0 / len(bucket)
+            for index, buffered in enumerate(bucket):
+                buffered["ts"] += index * step
+                yield buffered
+            bucket = []
+        if record is None:
+            yield None
+        else:
+            bucket.append(record)
+    if bucket:
+        step = 1.0 / len(bucket)
+        for index, buffered in enumerate(bucket):
+            buffered["ts"] += index * step
+            yield buffered
+
+
+def replay_schedule(path, fmt, methods, prefix, exclude, counts):
+    """Streams ``(offset_s, record)`` pairs for the replayable requests in a log.
+
+    Offsets are relative to the first replayed request and never decrease
+    (access logs are written in completion order, so start times can be
+    slightly out of order). Skipped lines are tallied in ``counts``.
+    """
+    if fmt == "auto":
+        fmt = "jsonl" if path.endswith((".jsonl", ".jsonl.gz", ".ndjson")) else "nginx"
+    exclude = re.compile(exclude) if exclude else None
+    with open_log(path) as lines:
+        if fmt == "jsonl":
+            records = parse_jsonl_log(lines)
+        else:
+            records = spread_within_second(parse_nginx_log(lines))
+        first = None
+        last_offset = 0.0
+        for record in records:
+            if record is None:
+                counts["unparsed"] += 1
+                continue
+            path_only = record["path"].split("?", 1)[0]
+            if (
+                record["method"] not in methods
+                or not path_only.startswith(prefix)
+                or (exclude is not None and exclude.search(path_only))
+            ):
+                counts["filtered"] += 1
+                continue
+            if first is None:
+                first = record["ts"]
+            last_offset = max(last_offset, record["ts"] - first)
+            yield last_offset, record
+
+
+@functools.lru_cache(maxsize=4096)
+def route_name(method, path):
+    """Groups a concrete request path into a route name, e.g. ``GET /api/messages/{id}``."""
+    segments = path.split("?", 1)[0].split("/")
+    return f"{method} " + "/".join("{id}" if ID_SEGMENT.match(segment) else segment for segment in segments)
+
+
+def load_user_map(path):
+    """Loads a JSON object mapping logged users (or client IPs) to account emails."""
+    with open(path, encoding="utf-8") as f:
+        return {str(key): str(value).lower() for key, value in json.load(f).items()}
+
+
+class LatencyHistogram:
+    """Fixed-memory, log-bucketed latency histogram (HdrHistogram layout).
+
+    Values are recorded as integer microseconds. Values below
+    ``2 ** SUB_BUCKET_BITS`` are counted exactly; above that every power of two
+    is split into ``2 ** (SUB_BUCKET_BITS - 1)`` linear sub-buckets, giving a
+    relative error under 1% up to ``MAX_VALUE_US``. Memory is a flat list of a
+    few thousand counters no matter how many values are recorded, and two
+    histograms merge by adding their counters.
+    """
+
+    SUB_BUCKET_BITS = 8
+    SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+    SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+    MAX_VALUE_US = (1 << 32) - 1  # ~71 minutes
+
     def __init__(self):
-        self.token = None
-        self.user_id = None
-        self.stats = {"requests": 0, "errors": 0, "latencies": []}
+        self.counts = [0] * (self._index(self.MAX_VALUE_US) + 1)
+        self.total = 0
+        self.sum_us = 0
+        self.min_us = None
+        self.max_us = None
+
+    @classmethod
+    def _index(cls, value):
+        if value < cls.SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        sub = value >> shift
+        return cls.SUB_BUCKET_COUNT + (shift - 1) * cls.SUB_BUCKET_HALF + (sub - cls.SUB_BUCKET_HALF)
+
+    @classmethod
+    def _upper_bound(cls, index):
+        """Highest value that maps to the bucket at ``index``."""
+        if index < cls.SUB_BUCKET_COUNT:
+            return index
+        offset = index - cls.SUB_BUCKET_COUNT
+        shift = offset // cls.SUB_BUCKET_HALF + 1
+        sub = offset % cls.SUB_BUCKET_HALF + cls.SUB_BUCKET_HALF
+        return ((sub + 1) << shift) - 1
+
+    def record(self, latency_ms):
+        value = min(max(int(latency_ms * 1000), 0), self.MAX_VALUE_US)
+        self.counts[self._index(value)] += 1
+        self.total += 1
+        self.sum_us += value
+        if self.min_us is None or value < self.min_us:
+            self.min_us = value
+        if self.max_us is None or value > self.max_us:
+            self.max_us = value
+
+    def merge(self, other):
+        """Adds the counts of ``other`` into this histogram."""
+        if other.total == 0:
+            return self
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum_us += other.sum_us
+        self.min_us = other.min_us if self.min_us is None else min(self.min_us, other.min_us)
+        self.max_us = other.max_us if self.max_us is None else max(self.max_us, other.max_us)
+        return self
+
+    def percentile(self, pct):
+        """Returns the latency in ms at or below which ``pct`` percent of values fall."""
+        if self.total == 0:
+            return 0.0
+        target = max(1, math.ceil(self.total * pct / 100.0))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self._upper_bound(index), self.max_us) / 1000.0
+        return self.max_us / 1000.0
+
+    def mean(self):
+        return (self.sum_us / self.total) / 1000.0 if self.total else 0.0
+
+    def min(self):
+        return (self.min_us or 0) / 1000.0
 
-    async def login(self, session):
-        """Authenticates the user and retrieves a token."""
-        login_url = f"{BASE_URL}/auth/login"
+    def max(self):
+        return (self.max_us or 0) / 1000.0
+
+    def to_dict(self):
+        """Sparse, JSON-serialisable form used to ship histograms between processes."""
+        return {
+            "counts": {str(i): c for i, c in enumerate(self.counts) if c},
+            "total": self.total,
+            "sum_us": self.sum_us,
+            "min_us": self.min_us,
+            "max_us": self.max_us,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls()
+        for index, count in data["counts"].items():
+            hist.counts[int(index)] = count
+        hist.total = data["total"]
+        hist.sum_us = data["sum_us"]
+        hist.min_us = data["min_us"]
+        hist.max_us = data["max_us"]
+        return hist
+
+
+class LoadTester:
+    def __init__(self, options=None, worker_id=None, user_offset=0):
+        self.options = options or parse_args([])
+        # Set when running as one of several --workers processes
+        self.worker_id = worker_id
+        self.user_offset = user_offset
+        # Authenticated accounts; virtual users are bound to them round-robin
+        self.identities = []
+        self.scenario = load_scenario(self.options.scenario) if self.options.scenario else default_scenario()
+        if self.options.think_time is not None:
+            for journey in self.scenario["journeys"]:
+                for step in journey["steps"]:
+                    step["think_time"] = self.options.think_time
+        self.plans = []
+        # Plan by its current bearer token, for swapping in a new token after a 401
+        self.plan_by_token = {}
+        self.relogins = {}
+        self.passwords = None
+        # Per-endpoint stats since the last live tick (only kept with --live-interval)
+        self.interval = {}
+        # Load profile state: current stage table slot and open-loop rate bounds
+        self.stage_slot = None
+        self.stage_started = None
+        self.rate_from = self.rate_to = self.options.rps
+        self.stopping = False
+        self.live_started = None
+        self.live_last = None
+        # perf_counter() bounds of the load phase, for throughput
+        self.started = None
+        self.finished = None
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "endpoints": {},
+            "aborted_journeys": 0,
+            # Logins repeated because the API rejected a token with 401
+            "relogins": 0,
+            # Check failures found only because the response was in the decode sample
+            "sampled_failures": 0,
+            # Per-stage stats of a step/ramp load profile
+            "stages": [],
+            # Open-loop schedule accounting
+            "scheduled": 0,
+            "late": 0,
+            "missed": 0,
+            "send_lag": LatencyHistogram(),
+            "service_latency": LatencyHistogram(),
+            # Connection accounting from aiohttp trace hooks
+            "connections_new": 0,
+            "connections_reused": 0,
+            "pool_wait": LatencyHistogram(),
+            "dns": LatencyHistogram(),
+            "connect": LatencyHistogram(),
+            "request_excl_connect": LatencyHistogram(),
+            # Client events sent by websocket publishers
+            "ws_published": 0,
+            # Replay-mode log lines that could not be parsed or were filtered out
+            "replay_unparsed": 0,
+            "replay_filtered": 0,
+            # CPU seconds this generator process spent during the load phase
+            "cpu_s": 0.0,
+            # Min-heap of (latency_ms, seq, details) for the slowest requests
+            "slowest": [],
+        }
+        self.slowest_limit = self.options.slowest
+        self.slow_seq = 0
+        # Per-endpoint tables every result is recorded into (see record())
+        self.tables = [self.stats["endpoints"]]
+        if self.options.live_interval:
+            self.tables.append(self.interval)
+
+    def endpoint_stats(self, name):
+        """Returns the (lazily created) per-endpoint counters and histogram."""
+        return endpoint_entry(self.stats["endpoints"], name)
+
+    async def login(self, session, email, password, verbose=True):
+        """Authenticates one account and returns its identity, or None on failure."""
+        login_url = f"{self.options.base_url}/auth/login"
         payload = {
-            "email": EMAIL,
-            "password": PASSWORD,
+            "email": email,
+            "password": password,
             "device_name": "load-test-script",
         }
 
         try:
-            print(
-                f"[{datetime.now().strftime('%H:%M:%S')}] Attempting login to {login_url}..."
-            )
+            if verbose:
+                print(
+                    f"[{datetime.now().strftime('%H:%M:%S')}] Attempting login to {login_url}..."
+                )
             async with session.post(login_url, json=payload) as response:
                 if response.status == 200:
                     data = await response.json()
-                    self.token = data.get("token") or data.get(
+                    token = data.get("token") or data.get(
                         "access_token"
                     )  # Adapt to actual response structure
                     # Try to get user ID if available
+                    user_id = None
                     if "user" in data:
-                        self.user_id = data["user"].get("id")
+                        user_id = data["user"].get("id")
 
-                    if self.token:
-                        print(
-                            f"[{datetime.now().strftime('%H:%M:%S')}] Login successful! Token acquired."
-                        )
-                        return True
+                    if token:
+                        if verbose:
+                            print(
+                                f"[{datetime.now().strftime('%H:%M:%S')}] Login successful! Token acquired."
+                            )
+                        return {"email": email, "token": token, "user_id": user_id}
                     else:
                         print(
-                            f"[{datetime.now().strftime('%H:%M:%S')}] Login failed: No token in response. Response: {data}"
+                            f"[{datetime.now().strftime('%H:%M:%S')}] Login failed for {email}: No token in response. Response: {data}"
                         )
-                        return False
+                        return None
                 else:
                     text = await response.text()
                     print(
-                        f"[{datetime.now().strftime('%H:%M:%S')}] Login failed with status {response.status}: {text}"
+                        f"[{datetime.now().strftime('%H:%M:%S')}] Login failed for {email} with status {response.status}: {text[:200]}"
                     )
-                    return False
+                    return None
         except Exception as e:
-            print(f"[{datetime.now().strftime('%H:%M:%S')}] Login exception: {str(e)}")
-            return False
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Login exception for {email}: {str(e)}")
+            return None
 
-    async def simulate_user(self, session, user_id):
-        """Simulates a single user session looping through endpoints."""
-        start_time = time.time()
+    async def authenticate(self, session):
+        """Logs in every account from the credentials source, reusing cached tokens.
 
-        while DURATION == 0 or (time.time() - start_time) < DURATION:
-            # Pick an endpoint based on weight
-            endpoint = random.choices(
-                ENDPOINTS, weights=[e["weight"] for e in ENDPOINTS], k=1
-            )[0]
-
-            full_url = f"{BASE_URL}{endpoint['url']}"
-            headers = {
-                "Authorization": f"Bearer {self.token}",
-                "Accept": "application/json",
-                "User-Agent": f"LoadTest/1.0 User-{user_id}",
-            }
+        Logins run concurrently, bounded by ``--login-concurrency``. Tokens are
+        cached per API base URL in ``--token-cache`` so later runs skip the
+        login storm. Cached tokens older than ``--token-ttl`` are renewed, and a
+        token the API rejects with 401 mid-run is renewed by ``refresh_token``;
+        pass ``--refresh-tokens`` to ignore the cache.
+        """
+        accounts = load_accounts(self.options)
+        self.passwords = dict(accounts)
+        peak = peak_users(self.options)
+        if 1 < len(accounts) < peak and self.options.mode != "open":
+            print(f"Warning: {peak} virtual users share {len(accounts)} accounts; "
+                  f"raise --accounts or add credentials for one identity per user")
+        cache = load_token_cache(self.options.token_cache)
+        cached = cache.get(self.options.base_url, {})
+        ttl = self.options.token_ttl
+        now = time.time()
 
-            req_start = time.time()
-            try:
-                if endpoint["method"] == "GET":
-                    async with session.get(full_url, headers=headers) as response:
-                        await response.read()  # Read body to complete request
-                        status = response.status
-                elif endpoint["method"] == "POST":
-                    data = endpoint.get("data", {})
-                    # Add timestamps to make data unique-ish
-                    if "message" in data:
-                        data["message"] = f"Load test message {time.time()}"
-
-                    async with session.post(
-                        full_url, json=data, headers=headers
-                    ) as response:
-                        await response.read()
-                        status = response.status
-
-                latency = (time.time() - req_start) * 1000  # ms
-                self.stats["requests"] += 1
-                self.stats["latencies"].append(latency)
-
-                status_symbol = "✅" if 200 <= status < 300 else "❌"
-                # print(f"[{datetime.now().strftime('%H:%M:%S')}] User-{user_id} {endpoint['method']} {endpoint['url']} - {status} {status_symbol} ({latency:.1f}ms)")
-
-                if status >= 400:
-                    self.stats["errors"] += 1
+        identities = [None] * len(accounts)
+        pending = []
+        for index, (email, password) in enumerate(accounts):
+            entry = None if self.options.refresh_tokens else cached.get(email)
+            if entry and entry.get("token") and (not ttl or now - entry.get("issued_at", 0) < ttl):
+                identities[index] = {"email": email, "token": entry["token"], "user_id": entry.get("user_id")}
+            else:
+                pending.append((index, email, password))
+
+        started = time.perf_counter()
+        if pending:
+            semaphore = asyncio.Semaphore(self.options.login_concurrency)
+            verbose = len(accounts) == 1
+
+            async def bounded_login(index, email, password):
+                async with semaphore:
+                    identities[index] = await self.login(session, email, password, verbose=verbose)
+
+            await asyncio.gather(*(bounded_login(*item) for item in pending))
+
+        self.identities = [identity for identity in identities if identity]
+        print(
+            f"[{datetime.now().strftime('%H:%M:%S')}] Authenticated {len(self.identities)}/{len(accounts)} "
+            f"accounts ({len(accounts) - len(pending)} from token cache, "
+            f"{len(pending)} logins in {time.perf_counter() - started:.1f}s)"
+        )
+
+        if pending:
+            self.cache_tokens([identities[index] for index, _, _ in pending if identities[index]])
 
-            except Exception as e:
+        return bool(self.identities)
+
+    def cache_tokens(self, identities):
+        """Stores freshly issued tokens in ``--token-cache``."""
+        if not self.options.token_cache or not identities:
+            return
+        cache = load_token_cache(self.options.token_cache)
+        cached = cache.setdefault(self.options.base_url, {})
+        now = time.time()
+        for identity in identities:
+            cached[identity["email"]] = {"token": identity["token"], "user_id": identity["user_id"], "issued_at": now}
+        save_token_cache(self.options.token_cache, cache)
+
+    async def refresh_token(self, session, headers):
+        """Logs an account in again after its token got a 401 and swaps the new token into its plan.
+
+        ``headers`` are the plan's shared header dicts, so every later request
+        of the account uses the new token. Concurrent 401s for the same token
+        share one login; a token that cannot be renewed is not retried.
+        """
+        stale = headers.get("Authorization", "")[len("Bearer "):]
+        task = self.relogins.get(stale)
+        if task is None:
+            if stale not in self.plan_by_token:
+                return
+            task = self.relogins[stale] = asyncio.ensure_future(self._relogin(session, stale))
+        await task
+
+    async def _relogin(self, session, stale):
+        plan = self.plan_by_token.pop(stale)
+        email = plan.variables["email"]
+        if self.passwords is None:
+            # Workers receive identities, not credentials
+            self.passwords = dict(load_accounts(self.options))
+        identity = await self.login(session, email, self.passwords.get(email, self.options.password), verbose=False)
+        if identity is None:
+            return
+        self.stats["relogins"] += 1
+        plan.headers["Authorization"] = plan.json_headers["Authorization"] = f"Bearer {identity['token']}"
+        self.plan_by_token[identity["token"]] = plan
+        for index, current in enumerate(self.identities):
+            if current["token"] == stale:
+                self.identities[index] = identity
+        self.cache_tokens([identity])
+
+    def compile_plans(self):
+        """Pre-builds one request plan per authenticated account."""
+        self.plans = [
+            compile_plan(self.scenario, identity, account, self.options.base_url)
+            for account, identity in enumerate(self.identities)
+        ]
+        self.plan_by_token = {identity["token"]: plan for identity, plan in zip(self.identities, self.plans)}
+
+    def plan_for(self, user_id):
+        """Binds a virtual user to one authenticated account's request plan."""
+        return self.plans[user_id % len(self.plans)]
+
+    def record(self, name, latency=None, error=None, size=0, server=None, overhead=None):
+        """Records one request outcome in every active per-endpoint table.
+
+        The tables are the cumulative stats plus, when enabled, the current
+        live interval and the current load-profile stage. ``size`` is the
+        number of response body bytes received; ``server`` is the application
+        time reported by the response headers and ``overhead`` the client
+        service time minus it.
+        """
+        for table in self.tables:
+            entry = endpoint_entry(table, name)
+            entry["bytes"] += size
+            if server is not None:
+                if "server" not in entry:
+                    entry["server"] = LatencyHistogram()
+                    entry["overhead"] = LatencyHistogram()
+                entry["server"].record(server)
+                entry["overhead"].record(overhead)
+            if latency is not None:
+                entry["requests"] += 1
+                entry["latency"].record(latency)
+            if error is not None:
+                entry["errors"] += 1
+                by_status = entry["errors_by_status"]
+                by_status[error] = by_status.get(error, 0) + 1
+
+    async def send_request(self, session, step, url, body, headers, intended_start=None):
+        """Sends one request and records it against the step's stats.
+
+        Returns ``(payload, document)`` for successful responses, otherwise
+        None. ``document`` is the decoded JSON body when it had to be parsed
+        for the step's ``expect`` check, else None.
+
+        ``expect`` checks first search the raw body for the required key names;
+        only when that passes, and the step extracts values or the response is
+        picked by ``--validate-sample``, is the body decoded for the full check.
+
+        In open-loop mode ``intended_start`` is the scheduled send time
+        (a ``time.perf_counter()`` value); latency is then measured from that
+        point so time spent waiting behind a slow backend is not hidden.
+        """
+        req_start = time.perf_counter()
+        try:
+            async with session.request(step.method, url, data=body, headers=headers) as response:
+                payload = await response.read()  # Read body to complete request
+                status = response.status
+                response_headers = response.headers
+
+            req_end = time.perf_counter()
+            latency = (req_end - (intended_start or req_start)) * 1000  # ms
+            service = (req_end - req_start) * 1000
+            self.stats["requests"] += 1
+            if intended_start is not None:
+                self.stats["service_latency"].record(service)
+
+            server = server_time_ms(response_headers)
+            overhead = None if server is None else max(0.0, service - server)
+            slowest = self.stats["slowest"]
+            if self.slowest_limit and (len(slowest) < self.slowest_limit or latency > slowest[0][0]):
+                self.slow_seq += 1
+                sample = (latency, self.slow_seq, {
+                    "endpoint": step.name,
+                    "method": step.method,
+                    "url": url,
+                    "status": status,
+                    "latency_ms": round(latency, 3),
+                    "server_ms": server,
+                    "request_id": response_headers.get("X-Request-Id") or response_headers.get("X-Correlation-Id"),
+                    "at": datetime.now().isoformat(timespec="milliseconds"),
+                })
+                if len(slowest) < self.slowest_limit:
+                    heapq.heappush(slowest, sample)
+                else:
+                    heapq.heapreplace(slowest, sample)
+
+            size = len(payload)
+            if status >= 400:
                 self.stats["errors"] += 1
-                print(
-                    f"[{datetime.now().strftime('%H:%M:%S')}] Request failed: {str(e)}"
+                self.record(step.name, latency, str(status), size, server, overhead)
+                if status == 401:
+                    await self.refresh_token(session, headers)
+                return None
+
+            document = None
+            check = step.expect
+            if check is not None:
+                problem = check.prefilter(payload)
+                sampled = not (step.extract or check.min_items)
+                if problem is None and (not sampled or random.random() < self.options.validate_sample):
+                    try:
+                        document = json.loads(payload)
+                        problem = check.validate(document)
+                    except ValueError:
+                        problem = "invalid-json"
+                    if problem is not None and sampled:
+                        self.stats["sampled_failures"] += 1
+                if problem is not None:
+                    self.stats["errors"] += 1
+                    self.record(step.name, latency, f"invalid:{problem}", size, server, overhead)
+                    return None
+            self.record(step.name, latency, size=size, server=server, overhead=overhead)
+            return payload, document
+
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.record(step.name, error=type(e).__name__)
+            print(
+                f"[{datetime.now().strftime('%H:%M:%S')}] Request failed: {str(e)}"
+            )
+            return None
+
+    async def run_journey(self, session, plan, journey, iteration, intended_start=None, think_after_last=True):
+        """Runs the steps of one journey in order, honouring per-step think times.
+
+        Static steps use the URL, body and headers pre-built by ``compile_plan``.
+        Only steps that reference ``{iteration}`` or values extracted from an
+        earlier response are rendered here. A journey stops early when a step
+        that feeds later steps fails or its ``extract`` path is missing.
+        """
+        variables = None
+        last = len(journey.steps) - 1
+        for index, step in enumerate(journey.steps):
+            url, body = step.url, step.body
+            if step.dynamic:
+                if variables is None:
+                    variables = {**plan.variables, "iteration": iteration}
+                try:
+                    url = step.url.format_map(variables)
+                    if body is not None:
+                        body = json.dumps(render_template(body, variables)).encode("utf-8")
+                except (KeyError, IndexError):
+                    self.stats["aborted_journeys"] += 1
+                    return
+
+            response = await self.send_request(
+                session, step, url, body, step.headers, intended_start if index == 0 else None
+            )
+
+            if step.extract:
+                if response is None:
+                    self.stats["aborted_journeys"] += 1
+                    return
+                if variables is None:
+                    variables = {**plan.variables, "iteration": iteration}
+                payload, document = response
+                if document is None:
+                    try:
+                        document = json.loads(payload)
+                    except ValueError:
+                        pass
+                for var, path in step.extract:
+                    value = extract_path(document, path)
+                    if value is None:
+                        self.stats["aborted_journeys"] += 1
+                        return
+                    variables[var] = value
+
+            if index < last or think_after_last:
+                await asyncio.sleep(random.uniform(*step.think_time))
+
+    async def simulate_user(self, session, user_id, duration=None):
+        """Simulates a single user session looping through scenario journeys.
+
+        Runs for ``duration`` seconds (default ``--duration``; 0 means until
+        the test stops).
+        """
+        start_time = time.time()
+        duration = self.options.duration if duration is None else duration
+        plan = self.plan_for(user_id)
+        iteration = 0
+
+        while not self.stopping and (duration == 0 or (time.time() - start_time) < duration):
+            await self.run_journey(session, plan, plan.pick_journey(), iteration)
+            iteration += 1
+
+    async def run_open_loop(self, session, duration=None):
+        """Starts journeys on a fixed-rate or Poisson arrival schedule.
+
+        Each arrival runs one journey (a single request for the default
+        scenario). The schedule never waits for responses, so a slow backend
+        cannot lower the offered load. When the generator falls behind,
+        overdue arrivals are sent immediately and their lag is recorded; when
+        ``max_in_flight`` journeys are already outstanding the arrival is
+        dropped and counted as missed.
+        """
+        duration = self.options.duration if duration is None else duration
+        poisson = self.options.arrival == "poisson"
+        in_flight = set()
+        seq = 0
+
+        start = time.perf_counter()
+        next_send = start
+        while duration == 0 or (next_send - start) < duration:
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self.stats["scheduled"] += 1
+            if len(in_flight) >= self.options.max_in_flight:
+                self.stats["missed"] += 1
+            else:
+                lag_ms = (time.perf_counter() - next_send) * 1000
+                self.stats["send_lag"].record(lag_ms)
+                if lag_ms > LATE_SEND_THRESHOLD_MS:
+                    self.stats["late"] += 1
+                plan = self.plan_for(seq)
+                task = asyncio.create_task(
+                    self.run_journey(
+                        session, plan, plan.pick_journey(), seq,
+                        intended_start=next_send, think_after_last=False,
+                    )
                 )
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+
+            seq += 1
+            rps = self.current_rate()
+            next_send += random.expovariate(rps) if poisson else 1.0 / rps
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    def replay_accounts(self):
+        """Returns the replay-account picker for logged clients.
+
+        Clients named in ``--replay-user-map`` use their mapped account; every
+        other client is hashed onto a fixed account, so each logged user keeps
+        one token for the whole replay.
+        """
+        by_email = {identity["email"].lower(): index for index, identity in enumerate(self.identities)}
+        mapped = {}
+        if self.options.replay_user_map:
+            for client, email in load_user_map(self.options.replay_user_map).items():
+                if email in by_email:
+                    mapped[client] = by_email[email]
+        count = len(self.plans)
+
+        def account_for(client):
+            index = mapped.get(client)
+            return index if index is not None else zlib.crc32(client.encode("utf-8")) % count
+
+        return account_for
+
+    async def run_replay(self, session):
+        """Re-issues the requests of a recorded access log on their original schedule.
+
+        The log is streamed, never loaded whole; inter-arrival times are kept
+        and divided by ``--replay-speed``. Like the open loop, sends never wait
+        for responses, latency is measured from the scheduled time and sends
+        beyond ``max_in_flight`` are counted as missed. With several workers
+        each one replays the clients that hash to it, so a client's requests
+        stay in order on one process.
+        """
+        options = self.options
+        speed = options.replay_speed
+        base = urlsplit(options.base_url)
+        origin = f"{base.scheme}://{base.netloc}"
+        prefix = base.path.rstrip("/")
+        methods = {method.strip().upper() for method in options.replay_methods.split(",") if method.strip()}
+        counts = {"unparsed": 0, "filtered": 0}
+        account_for = self.replay_accounts()
+        steps = {}
+        in_flight = set()
+
+        start = time.perf_counter()
+        try:
+            for offset, record in replay_schedule(
+                options.replay, options.replay_format, methods, prefix, options.replay_exclude, counts
+            ):
+                offset /= speed
+                if options.duration and offset >= options.duration:
+                    break
+                client = record["client"]
+                if options.workers > 1 and zlib.crc32(client.encode("utf-8")) % options.workers != self.worker_id:
+                    continue
+
+                intended = start + offset
+                delay = intended - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                self.stats["scheduled"] += 1
+                if len(in_flight) >= options.max_in_flight:
+                    self.stats["missed"] += 1
+                    continue
+                lag_ms = (time.perf_counter() - intended) * 1000
+                self.stats["send_lag"].record(lag_ms)
+                if lag_ms > LATE_SEND_THRESHOLD_MS:
+                    self.stats["late"] += 1
+
+                method = record["method"]
+                name = route_name(method, record["path"])
+                step = steps.get(name)
+                if step is None:
+                    step = steps[name] = CompiledStep()
+                    step.name, step.method, step.extract, step.expect = name, method, [], None
+                plan = self.plans[account_for(client)]
+                body = record.get("json")
+                if body is not None:
+                    body, headers = json.dumps(body).encode("utf-8"), plan.json_headers
+                else:
+                    headers = plan.headers
+                task = asyncio.create_task(
+                    self.send_request(session, step, origin + record["path"], body, headers, intended_start=intended)
+                )
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+        finally:
+            # Every worker reads the whole log; count skipped lines once
+            if not self.worker_id:
+                self.stats["replay_unparsed"] += counts["unparsed"]
+                self.stats["replay_filtered"] += counts["filtered"]
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    def ws_endpoint(self):
+        """Pusher-protocol URL of the Reverb app (http(s) URLs map to ws(s))."""
+        base = self.options.ws_url.rstrip("/")
+        if base.startswith("https://"):
+            base = "wss://" + base[len("https://"):]
+        elif base.startswith("http://"):
+            base = "ws://" + base[len("http://"):]
+        return f"{base}/app/{self.options.ws_app_key}?protocol=7&client=fwber-load-test&version=1.0&flash=false"
+
+    def ws_record(self, name, latency=None, error=None):
+        """Counts a websocket event in the run totals and its per-event stats."""
+        if latency is not None:
+            self.stats["requests"] += 1
+        if error is not None:
+            self.stats["errors"] += 1
+        self.record(name, latency, error)
+
+    async def ws_authorize(self, session, identity, socket_id, channel):
+        """Signs a private/presence subscription through the broadcasting auth endpoint."""
+        started = time.perf_counter()
+        try:
+            async with session.post(
+                self.options.ws_auth_url,
+                data={"socket_id": socket_id, "channel_name": channel},
+                headers={"Authorization": f"Bearer {identity['token']}", "Accept": "application/json"},
+            ) as response:
+                if response.status != 200:
+                    self.ws_record("WS Channel Auth", error=str(response.status))
+                    return None
+                data = await response.json()
+        except Exception as e:
+            self.ws_record("WS Channel Auth", error=type(e).__name__)
+            return None
+        self.ws_record("WS Channel Auth", (time.perf_counter() - started) * 1000)
+        return data
+
+    async def ws_client(self, session, user_id, stop_at):
+        """Holds one Pusher-protocol connection until ``stop_at``.
+
+        Records handshake latency (TCP/TLS, upgrade and
+        ``pusher:connection_established``), per-channel subscribe latency,
+        ping round trips and the delivery delay of fan-out messages carrying a
+        ``sent_at`` timestamp. The first ``--ws-publishers`` connections
+        publish such messages as client events on the fan-out channel.
+        """
+        identity = self.identity_for(user_id)
+        variables = {"user_id": identity.get("user_id"), "email": identity["email"], "account": user_id}
+        channels = [template.format_map(variables) for template in self.options.ws_channels]
+        publish_channel = (self.options.ws_publish_channel or channels[0]).format_map(variables) if channels else None
+
+        started = time.perf_counter()
+        # Failures before connection_established are handshake errors, later ones connection errors
+        stage = "WS Handshake"
+        try:
+            async with session.ws_connect(self.ws_endpoint(), autoping=True) as ws:
+                message = await ws.receive_json(timeout=WS_HANDSHAKE_TIMEOUT)
+                if message.get("event") != "pusher:connection_established":
+                    self.ws_record("WS Handshake", error=message.get("event", "unexpected"))
+                    return
+                self.ws_record("WS Handshake", (time.perf_counter() - started) * 1000)
+                stage = "WS Connection"
+                socket_id = decode_pusher_data(message.get("data"))["socket_id"]
+
+                pending = {}
+                for channel in channels:
+                    data = {"channel": channel}
+                    if channel.startswith(("private-", "presence-")):
+                        auth = await self.ws_authorize(session, identity, socket_id, channel)
+                        if auth is None:
+                            continue
+                        data.update({key: auth[key] for key in ("auth", "channel_data") if key in auth})
+                    pending[channel] = time.perf_counter()
+                    await ws.send_json({"event": "pusher:subscribe", "data": data})
+
+                # Send time of the outstanding pusher:ping, shared with the receive loop
+                ping = {"sent": None}
+                tasks = [asyncio.create_task(self.ws_pinger(ws, ping))]
+                if publish_channel and user_id < self.options.ws_publishers:
+                    tasks.append(asyncio.create_task(self.ws_publisher(ws, publish_channel, user_id)))
+                try:
+                    await self.ws_receive(ws, pending, ping, stop_at)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    # A failed ping or publish send ends its task; report it instead of dropping it
+                    for outcome in await asyncio.gather(*tasks, return_exceptions=True):
+                        if isinstance(outcome, Exception):
+                            self.ws_record("WS Connection", error=type(outcome).__name__)
+        except Exception as e:
+            self.ws_record(stage, error=type(e).__name__)
+
+    async def ws_receive(self, ws, pending, ping, stop_at):
+        while not self.stopping:
+            remaining = None if stop_at is None else stop_at - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                return
+            try:
+                msg = await ws.receive(timeout=remaining)
+            except asyncio.TimeoutError:
+                return
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                if msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    self.ws_record("WS Connection", error="closed")
+                    return
+                continue
+
+            received = time.time()
+            message = json.loads(msg.data)
+            event = message.get("event", "")
+            if event == "pusher_internal:subscription_succeeded":
+                sent = pending.pop(message.get("channel"), None)
+                if sent is not None:
+                    self.ws_record("WS Subscribe", (time.perf_counter() - sent) * 1000)
+            elif event == "pusher:error" or event == "pusher:subscription_error":
+                self.ws_record("WS Subscribe", error=str(decode_pusher_data(message.get("data")).get("code", event)))
+            elif event == "pusher:pong":
+                if ping["sent"] is not None:
+                    self.ws_record("WS Ping", (time.perf_counter() - ping["sent"]) * 1000)
+                    ping["sent"] = None
+            else:
+                data = decode_pusher_data(message.get("data"))
+                if isinstance(data, dict) and "sent_at" in data:
+                    self.ws_record("WS Fan-out Delivery", (received - data["sent_at"]) * 1000)
+
+    async def ws_pinger(self, ws, ping):
+        """Keeps the connection alive (Reverb drops idle sockets) and measures ping RTT."""
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            ping["sent"] = time.perf_counter()
+            await ws.send_json({"event": "pusher:ping", "data": {}})
+
+    async def ws_publisher(self, ws, channel, user_id):
+        seq = 0
+        while True:
+            await asyncio.sleep(self.options.ws_publish_interval)
+            await ws.send_json({
+                "event": WS_CLIENT_EVENT,
+                "channel": channel,
+                "data": {"sent_at": time.time(), "from": user_id, "seq": seq},
+            })
+            self.stats["ws_published"] += 1
+            seq += 1
 
-            # Random delay between requests
-            delay = random.uniform(*DELAY_RANGE)
-            await asyncio.sleep(delay)
+    async def run_websocket(self, session):
+        """Opens ``--users`` Reverb connections at ``--ws-connect-rate`` per second and holds them."""
+        duration = self.options.duration
+        stop_at = None if duration == 0 else time.perf_counter() + duration
+        interval = 1.0 / self.options.ws_connect_rate if self.options.ws_connect_rate > 0 else 0.0
+        tasks = []
+        for i in range(self.options.users):
+            if stop_at is not None and time.perf_counter() >= stop_at:
+                break
+            tasks.append(asyncio.create_task(self.ws_client(session, self.user_offset + i, stop_at)))
+            if interval:
+                await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
 
-    async def run(self):
+    def identity_for(self, user_id):
+        """Binds a virtual user or connection to one authenticated account."""
+        return self.identities[user_id % len(self.identities)]
+
+    def current_rate(self):
+        """Open-loop target rate; follows the load profile when one is active."""
+        if self.rate_from == self.rate_to:
+            return self.rate_to
+        frac = min(1.0, (time.perf_counter() - self.stage_started) / self.options.step_duration)
+        return max(0.01, self.rate_from + (self.rate_to - self.rate_from) * frac)
+
+    def level_share(self, level):
+        """This process's share of a profile level (users or req/s)."""
+        workers = self.options.workers
+        if self.worker_id is None or workers <= 1:
+            return level if self.options.mode == "open" else int(level)
+        if self.options.mode == "open":
+            return level / workers
+        return _split(int(level), workers, self.worker_id)
+
+    def begin_stage(self, level):
+        """Closes the current profile stage and starts recording a new one."""
+        now = time.perf_counter()
+        stages = self.stats["stages"]
+        if stages:
+            stages[-1]["elapsed_s"] = now - self.stage_started
+        table = {}
+        stages.append({"level": self.level_share(level), "elapsed_s": 0.0, "endpoints": table})
+        if self.stage_slot is None:
+            self.stage_slot = len(self.tables)
+            self.tables.append(table)
+        else:
+            self.tables[self.stage_slot] = table
+        self.stage_started = now
+
+    def end_stage(self):
+        if self.stats["stages"]:
+            self.stats["stages"][-1]["elapsed_s"] = time.perf_counter() - self.stage_started
+
+    async def run_profile(self, session):
+        """Runs a step or ramp load profile, one reporting stage per level.
+
+        ``step`` jumps to each level and holds it for ``--step-duration``
+        seconds; ``ramp`` moves linearly from the previous level to the next
+        over the same window. Levels are virtual users in closed-loop mode and
+        req/s in open-loop mode.
+        """
+        levels = profile_levels(self.options)
+        step_duration = self.options.step_duration
+        ramp = self.options.profile == "ramp"
+        open_loop = self.options.mode == "open"
+
+        users = []
+        next_user = 0
+        open_task = None
+        try:
+            for index, level in enumerate(levels):
+                previous = levels[index - 1] if index else level
+                self.begin_stage(level)
+                stage_end = self.stage_started + step_duration
+
+                if open_loop:
+                    self.rate_from = self.level_share(previous if ramp else level)
+                    self.rate_to = self.level_share(level)
+                    if open_task is None:
+                        open_task = asyncio.create_task(
+                            self.run_open_loop(session, duration=len(levels) * step_duration)
+                        )
+                else:
+                    target = self.level_share(level)
+                    missing = target - sum(1 for task in users if not task.done())
+                    for n in range(max(0, missing)):
+                        if ramp and missing > 1:
+                            # Spread new users evenly over the stage
+                            await asyncio.sleep(max(0.0, stage_end - time.perf_counter()) / (missing - n))
+                        # Profile users run until the last stage ends, not for --duration
+                        users.append(asyncio.create_task(
+                            self.simulate_user(session, self.user_offset + next_user, duration=0)
+                        ))
+                        next_user += 1
+
+                await asyncio.sleep(max(0.0, stage_end - time.perf_counter()))
+        finally:
+            self.stopping = True
+            for task in users:
+                task.cancel()
+            if open_task:
+                await open_task
+            await asyncio.gather(*users, return_exceptions=True)
+            # Closed after draining so late completions don't inflate the last stage's throughput
+            self.end_stage()
+
+    def build_connector(self):
+        """Creates the TCP connector from the pool / keep-alive options."""
+        kwargs = {
+            # Each websocket holds a pool slot for its whole life
+            "limit": 0 if self.options.mode == "websocket" else self.options.pool_size,
+            "limit_per_host": self.options.limit_per_host,
+            "use_dns_cache": self.options.dns_ttl > 0,
+            "ttl_dns_cache": self.options.dns_ttl or None,
+            "force_close": self.options.force_close,
+        }
+        # aiohttp rejects a keep-alive timeout on connections it always closes
+        if not self.options.force_close:
+            kwargs["keepalive_timeout"] = self.options.keepalive_timeout
+        return aiohttp.TCPConnector(**kwargs)
+
+    def build_trace_config(self):
+        """Trace hooks that split pool wait, DNS and connect time from request time.
+
+        Connect time covers TCP and TLS setup (plus DNS on a cache miss), i.e.
+        the Nginx handshake cost. "Request" time runs from request start to
+        response headers minus pool wait and connection setup, approximating
+        upstream (PHP-FPM) time plus one round trip.
+        """
+        stats = self.stats
+
+        async def on_request_start(session, ctx, params):
+            ctx.start = time.perf_counter()
+            ctx.setup = 0.0
+
+        async def on_connection_queued_start(session, ctx, params):
+            ctx.queued = time.perf_counter()
+
+        async def on_connection_queued_end(session, ctx, params):
+            elapsed = time.perf_counter() - ctx.queued
+            ctx.setup += elapsed
+            stats["pool_wait"].record(elapsed * 1000)
+
+        async def on_dns_resolvehost_start(session, ctx, params):
+            ctx.dns = time.perf_counter()
+
+        async def on_dns_resolvehost_end(session, ctx, params):
+            stats["dns"].record((time.perf_counter() - ctx.dns) * 1000)
+
+        async def on_connection_create_start(session, ctx, params):
+            ctx.connecting = time.perf_counter()
+
+        async def on_connection_create_end(session, ctx, params):
+            elapsed = time.perf_counter() - ctx.connecting
+            ctx.setup += elapsed
+            stats["connections_new"] += 1
+            stats["connect"].record(elapsed * 1000)
+
+        async def on_connection_reuseconn(session, ctx, params):
+            stats["connections_reused"] += 1
+
+        async def on_request_end(session, ctx, params):
+            elapsed = time.perf_counter() - ctx.start - ctx.setup
+            stats["request_excl_connect"].record(elapsed * 1000)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_queued_start.append(on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(on_connection_queued_end)
+        trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_request_end.append(on_request_end)
+        return trace_config
+
+    def print_banner(self):
+        if self.options.mode == "websocket":
+            print(
+                f"Starting websocket load test: {self.options.users} Reverb connections "
+                f"for {self.options.duration} seconds."
+            )
+            print(f"Websocket: {self.ws_endpoint()}")
+            print(f"Channels: {', '.join(self.options.ws_channels) or 'none'}")
+        elif self.options.profile != "constant":
+            levels = profile_levels(self.options)
+            unit = "req/s" if self.options.mode == "open" else "users"
+            print(
+                f"Starting {self.options.profile} profile ({self.options.mode} loop): "
+                f"{levels[0]:g} -> {levels[-1]:g} {unit} in {len(levels)} stages of {self.options.step_duration}s."
+            )
+        elif self.options.mode == "open":
+            print(
+                f"Starting open-loop load test at {self.options.rps} req/s "
+                f"({self.options.arrival} arrivals) for {self.options.duration} seconds."
+            )
+        elif self.options.mode == "replay":
+            limit = f"for up to {self.options.duration} seconds" if self.options.duration else "until the log ends"
+            print(
+                f"Replaying {self.options.replay} at {self.options.replay_speed:g}x speed {limit} "
+                f"(methods {self.options.replay_methods})."
+            )
+        else:
+            print(
+                f"Starting load test with {self.options.users} concurrent users for {self.options.duration} seconds."
+            )
+        if self.options.workers > 1:
+            print(f"Workers: {self.options.workers} processes")
+        keepalive = "off (forced reconnect)" if self.options.force_close else f"{self.options.keepalive_timeout:g}s"
+        pool_size = "unlimited" if self.options.mode == "websocket" else self.options.pool_size
         print(
-            f"Starting load test with {CONCURRENT_USERS} concurrent users for {DURATION} seconds."
+            f"Pool: {pool_size} connections, "
+            f"{self.options.limit_per_host or 'unlimited'} per host, "
+            f"DNS TTL {self.options.dns_ttl or 'off'}, keep-alive {keepalive}"
         )
-        print(f"Target: {BASE_URL}")
+        print(f"Target: {self.options.base_url}")
+        if self.options.mode not in ("websocket", "replay"):
+            print(f"Scenario: {self.scenario['name']} ({len(self.scenario['journeys'])} journeys)")
+
+    async def run(self, report=True, live_sink=None):
+        if report:
+            self.print_banner()
 
-        async with aiohttp.ClientSession() as session:
-            # 1. Login once to get token (simulating one logged-in user behaving as many,
-            # or ideally we'd have multiple accounts, but reusing token is simpler for load gen)
-            if not await self.login(session):
+        async with aiohttp.ClientSession(
+            connector=self.build_connector(),
+            trace_configs=[self.build_trace_config()],
+        ) as session:
+            # 1. Log in every account (workers receive identities from the parent)
+            if not self.identities and not await self.authenticate(session):
                 print("Aborting: Could not authenticate.")
                 return
 
-            # 2. Launch concurrent user tasks
-            tasks = []
-            for i in range(CONCURRENT_USERS):
-                tasks.append(self.simulate_user(session, i))
+            self.compile_plans()
+
+            self.started = time.perf_counter()
+            cpu_started = time.process_time()
+            live_task = None
+            if self.options.live_interval:
+                self.live_started = self.live_last = time.perf_counter()
+                live_task = asyncio.create_task(self.live_reporter(live_sink))
 
-            await asyncio.gather(*tasks)
+            # 2. Launch concurrent user tasks, or the open-loop scheduler
+            try:
+                if self.options.mode == "websocket":
+                    await self.run_websocket(session)
+                elif self.options.profile != "constant":
+                    await self.run_profile(session)
+                elif self.options.mode == "open":
+                    await self.run_open_loop(session)
+                elif self.options.mode == "replay":
+                    await self.run_replay(session)
+                else:
+                    tasks = []
+                    for i in range(self.options.users):
+                        tasks.append(self.simulate_user(session, self.user_offset + i))
+
+                    await asyncio.gather(*tasks)
+            finally:
+                self.finished = time.perf_counter()
+                self.stats["cpu_s"] += time.process_time() - cpu_started
+                if live_task:
+                    live_task.cancel()
+                    # Flush the final partial interval
+                    if live_sink:
+                        live_sink(export_endpoints(self.take_interval()))
+                    elif self.interval:
+                        self.emit_live()
 
         # 3. Report
+        if report:
+            self.finish()
+
+    def take_interval(self):
+        """Returns the per-endpoint stats since the last tick and starts a new interval."""
+        # Copy and clear in place: self.tables keeps a reference to this dict
+        interval = dict(self.interval)
+        self.interval.clear()
+        return interval
+
+    def emit_live(self):
+        """Prints one live line and appends one JSONL row for the current interval."""
+        now = time.perf_counter()
+        row = build_live_row(self.take_interval(), now - self.live_started, now - self.live_last)
+        self.live_last = now
+
+        print(
+            f"[{datetime.now().strftime('%H:%M:%S')}] t+{row['elapsed_s']:.0f}s "
+            f"rps {row['rps']:.1f}  err {row['error_rate'] * 100:.1f}%  "
+            f"p50 {row['p50_ms']:.1f}  p95 {row['p95_ms']:.1f}  p99 {row['p99_ms']:.1f}  "
+            f"max {row['max_ms']:.1f} ms"
+        )
+        if self.options.live_jsonl:
+            with open(self.options.live_jsonl, "a", encoding="utf-8") as f:
+                f.write(json.dumps(row) + "\n")
+
+    async def live_reporter(self, sink=None):
+        """Emits interval stats every ``--live-interval`` seconds.
+
+        Worker processes pass a ``sink`` that forwards the exported interval to
+        the parent, which merges all workers and emits the combined line.
+        """
+        while True:
+            await asyncio.sleep(self.options.live_interval)
+            if sink:
+                sink(export_endpoints(self.take_interval()))
+            else:
+                self.emit_live()
+
+    def export_stats(self):
+        """Serialises stats so a worker process can hand them to the parent."""
+        exported = {}
+        for key, value in self.stats.items():
+            if isinstance(value, LatencyHistogram):
+                exported[key] = value.to_dict()
+            elif key == "endpoints":
+                exported[key] = export_endpoints(value)
+            elif key == "stages":
+                exported[key] = [{**stage, "endpoints": export_endpoints(stage["endpoints"])} for stage in value]
+            else:
+                exported[key] = value
+        return exported
+
+    def merge_stats(self, exported):
+        """Adds stats produced by ``export_stats`` (e.g. from a worker) into this tester."""
+        for key, value in exported.items():
+            if key == "endpoints":
+                merge_endpoints(self.stats["endpoints"], value)
+            elif key == "stages":
+                # Workers run the same stage clock; levels add up to the global level
+                stages = self.stats["stages"]
+                for index, stage in enumerate(value):
+                    if index == len(stages):
+                        stages.append({"level": 0, "elapsed_s": 0.0, "endpoints": {}})
+                    stages[index]["level"] += stage["level"]
+                    stages[index]["elapsed_s"] = max(stages[index]["elapsed_s"], stage["elapsed_s"])
+                    merge_endpoints(stages[index]["endpoints"], stage["endpoints"])
+            elif key == "slowest":
+                merged = heapq.nlargest(self.slowest_limit, self.stats["slowest"] + value, key=lambda item: item[0])
+                self.slow_seq += len(merged)
+                self.stats["slowest"] = [(latency, seq, details) for seq, (latency, _, details) in enumerate(merged)]
+                heapq.heapify(self.stats["slowest"])
+            elif isinstance(self.stats.get(key), LatencyHistogram):
+                self.stats[key].merge(LatencyHistogram.from_dict(value))
+            else:
+                self.stats[key] = self.stats.get(key, 0) + value
+
+    def estimated_errors(self):
+        """Errors with sampled check failures scaled up to the unsampled responses."""
+        rate = self.options.validate_sample
+        if not self.stats["sampled_failures"] or rate >= 1:
+            return self.stats["errors"]
+        return round(self.stats["errors"] + self.stats["sampled_failures"] * (1 / rate - 1))
+
+    def overall_latency(self):
+        """Merges every endpoint histogram into one overall histogram."""
+        overall = LatencyHistogram()
+        for entry in self.stats["endpoints"].values():
+            overall.merge(entry["latency"])
+        return overall
+
+    def stage_summaries(self):
+        return summarize_stages(self.stats["stages"])
+
+    def report_stages(self):
+        summaries = self.stage_summaries()
+        unit = "req/s" if self.options.mode == "open" else "users"
+        print(f"\nLoad profile stages ({self.options.profile}, level = {unit}):")
+        print(f"{'Stage':>5} {'Level':>8} {'Throughput':>11} {'Err%':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for index, stage in enumerate(summaries, 1):
+            print(
+                f"{index:>5} {stage['level']:>8g} {stage['throughput_rps']:>11.1f} "
+                f"{stage['error_rate'] * 100:>6.2f} {stage['p50_ms']:>9.1f} {stage['p95_ms']:>9.1f} {stage['p99_ms']:>9.1f}"
+            )
+        knee = detect_saturation(summaries)
+        if knee is None:
+            print("No saturation detected: throughput kept scaling with load.")
+        else:
+            healthy = summaries[knee - 1]
+            saturated = summaries[knee]
+            print(
+                f"Saturation at level {saturated['level']:g}: throughput {saturated['throughput_rps']:.1f} req/s "
+                f"({saturated['throughput_gain'] * 100:+.0f}% for {saturated['level_gain'] * 100:+.0f}% load), "
+                f"p99 {healthy['p99_ms']:.1f} -> {saturated['p99_ms']:.1f} ms. "
+                f"Last healthy level: {healthy['level']:g} {unit}."
+            )
+
+    def elapsed(self):
+        """Seconds spent generating load (so far, if the run was interrupted)."""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def build_result(self):
+        """Machine-readable summary of the run, written by ``--json-out``.
+
+        Histograms are stored in sparse form so ``compare`` (or a later merge)
+        can recompute any percentile.
+        """
+        elapsed = self.elapsed()
+        overall = self.overall_latency()
+        config = {key: value for key, value in vars(self.options).items() if key != "password"}
+        config["scenario_name"] = self.scenario["name"]
+
+        errors_by_status = {}
+        endpoints = {}
+        for name, entry in sorted(self.stats["endpoints"].items()):
+            hist = entry["latency"]
+            for key, count in entry["errors_by_status"].items():
+                errors_by_status[key] = errors_by_status.get(key, 0) + count
+            endpoints[name] = {
+                "requests": entry["requests"],
+                "errors": entry["errors"],
+                "errors_by_status": entry["errors_by_status"],
+                "bytes_received": entry["bytes"],
+                "avg_response_bytes": round(entry["bytes"] / entry["requests"], 1) if entry["requests"] else 0.0,
+                "throughput_rps": round(entry["requests"] / elapsed, 3) if elapsed else 0.0,
+                "mean_ms": round(hist.mean(), 3),
+                "percentiles_ms": {f"p{p:g}": hist.percentile(p) for p in REPORT_PERCENTILES},
+                "max_ms": hist.max(),
+                "histogram": hist.to_dict(),
+            }
+            if "server" in entry:
+                endpoints[name]["server_timing"] = {
+                    "samples": entry["server"].total,
+                    "server_ms": {f"p{p:g}": entry["server"].percentile(p) for p in (50, 95, 99)},
+                    "overhead_ms": {f"p{p:g}": entry["overhead"].percentile(p) for p in (50, 95, 99)},
+                    "server_histogram": entry["server"].to_dict(),
+                    "overhead_histogram": entry["overhead"].to_dict(),
+                }
+
+        requests = self.stats["requests"]
+        errors = self.estimated_errors()
+        received = sum(entry["bytes"] for entry in self.stats["endpoints"].values())
+        return {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            "config": config,
+            "duration_s": round(elapsed, 3),
+            "summary": {
+                "requests": requests,
+                "errors": errors,
+                "error_rate": round(errors / requests, 5) if requests else 0.0,
+                "sampled_failures": self.stats["sampled_failures"],
+                "throughput_rps": round(requests / elapsed, 3) if elapsed else 0.0,
+                "bytes_received": received,
+                "received_bytes_per_s": round(received / elapsed, 1) if elapsed else 0.0,
+                "avg_response_bytes": round(received / requests, 1) if requests else 0.0,
+                "mean_ms": round(overall.mean(), 3),
+                "percentiles_ms": {f"p{p:g}": overall.percentile(p) for p in REPORT_PERCENTILES},
+                "max_ms": overall.max(),
+                "aborted_journeys": self.stats["aborted_journeys"],
+                "generator_cpu_s": round(self.stats["cpu_s"], 3),
+                "generator_cpu_us_per_request": round(self.stats["cpu_s"] / requests * 1e6, 1) if requests else None,
+            },
+            "errors_by_status": errors_by_status,
+            "endpoints": endpoints,
+            "slowest_requests": self.slowest_requests(),
+            "stages": self.stage_summaries() if self.stats["stages"] else None,
+            "saturation_stage": detect_saturation(self.stage_summaries()) if self.stats["stages"] else None,
+            "open_loop": {
+                "scheduled": self.stats["scheduled"],
+                "late": self.stats["late"],
+                "missed": self.stats["missed"],
+                "send_lag": self.stats["send_lag"].to_dict(),
+                "service_latency": self.stats["service_latency"].to_dict(),
+            } if self.options.mode in ("open", "replay") else None,
+            "replay": {
+                "file": self.options.replay,
+                "speed": self.options.replay_speed,
+                "unparsed_lines": self.stats["replay_unparsed"],
+                "filtered_lines": self.stats["replay_filtered"],
+            } if self.options.mode == "replay" else None,
+            "connections": {
+                "new": self.stats["connections_new"],
+                "reused": self.stats["connections_reused"],
+                **{key: self.stats[key].to_dict() for key in ("pool_wait", "dns", "connect", "request_excl_connect")},
+            },
+        }
+
+    def slowest_requests(self):
+        """The slowest requests seen, slowest first."""
+        return [details for _, _, details in sorted(self.stats["slowest"], key=lambda item: -item[0])]
+
+    def report_server_timing(self):
+        """Splits client latency into server-reported time and overhead per endpoint."""
+        rows = [(name, entry) for name, entry in sorted(self.stats["endpoints"].items()) if "server" in entry]
+        if rows:
+            print("\nServer timing (ms, from Server-Timing / X-Response-Time / X-Runtime):")
+            header = (
+                f"{'Endpoint':<28} {'Samples':>8} {'Server p50':>11} {'Server p95':>11} "
+                f"{'Overhead p50':>13} {'Overhead p95':>13}"
+            )
+            print(header)
+            print("-" * len(header))
+            for name, entry in rows:
+                server, overhead = entry["server"], entry["overhead"]
+                print(
+                    f"{name[:28]:<28} {server.total:>8} {server.percentile(50):>11.1f} {server.percentile(95):>11.1f} "
+                    f"{overhead.percentile(50):>13.1f} {overhead.percentile(95):>13.1f}"
+                )
+            print("Overhead = client service time - server time (network, TLS, proxy and queueing)")
+
+        slowest = self.slowest_requests()
+        if slowest:
+            print(f"\nSlowest {min(len(slowest), 10)} of the {len(slowest)} kept requests:")
+            for details in slowest[:10]:
+                server = f"{details['server_ms']:.1f}" if details["server_ms"] is not None else "-"
+                print(
+                    f"  {details['latency_ms']:>9.1f} ms  server {server:>7}  {details['status']}  "
+                    f"{details['request_id'] or '-':<36}  {details['endpoint']}"
+                )
+
+    def finish(self):
+        """Prints the report and writes the ``--json-out`` artifact if requested."""
         self.report()
+        if self.options.json_out:
+            with open(self.options.json_out, "w", encoding="utf-8") as f:
+                json.dump(self.build_result(), f, indent=2)
+            print(f"Results written to {self.options.json_out}")
+
+    def report_errors(self):
+        """Error counts per endpoint and status / exception type."""
+        rows = [(name, entry) for name, entry in sorted(self.stats["endpoints"].items()) if entry["errors"]]
+        if rows:
+            print(f"\nErrors ({self.stats['errors']}):")
+            for name, entry in rows:
+                breakdown = ", ".join(
+                    f"{key} {count}" for key, count in sorted(entry["errors_by_status"].items(), key=lambda kv: -kv[1])
+                )
+                print(f"  {name[:28]:<28} {entry['errors']:>6}  {breakdown}")
 
     def report(self):
         print("\n--- Load Test Report ---")
         total_reqs = self.stats["requests"]
         if total_reqs == 0:
             print("No requests completed.")
+            self.report_errors()
             return
 
-        avg_latency = sum(self.stats["latencies"]) / total_reqs
-        max_latency = max(self.stats["latencies"])
-        min_latency = min(self.stats["latencies"])
-        error_rate = (self.stats["errors"] / total_reqs) * 100
+        overall = self.overall_latency()
+        errors = self.estimated_errors()
+        error_rate = (errors / total_reqs) * 100
 
         print(f"Total Requests: {total_reqs}")
-        print(f"Error Rate:     {error_rate:.2f}% ({self.stats['errors']} errors)")
-        print(f"Avg Latency:    {avg_latency:.2f} ms")
-        print(f"Min Latency:    {min_latency:.2f} ms")
-        print(f"Max Latency:    {max_latency:.2f} ms")
+        elapsed = self.elapsed()
+        if elapsed:
+            print(f"Throughput:     {total_reqs / elapsed:.1f} req/s over {elapsed:.1f}s")
+        print(
+            f"Error Rate:     {error_rate:.2f}% ({self.stats['errors']} errors"
+            + (f", ~{errors} estimated from sampled checks" if errors != self.stats["errors"] else "") + ")"
+        )
+        received = sum(entry["bytes"] for entry in self.stats["endpoints"].values())
+        print(
+            f"Received:       {received / 1e6:.2f} MB"
+            + (f" ({received / elapsed / 1e6:.2f} MB/s)" if elapsed else "")
+        )
+        if self.stats["cpu_s"]:
+            print(
+                f"Generator CPU:  {self.stats['cpu_s']:.1f}s "
+                f"({self.stats['cpu_s'] / total_reqs * 1e6:.0f} us/request)"
+            )
+        print(f"Avg Latency:    {overall.mean():.2f} ms")
+        print(f"Min Latency:    {overall.min():.2f} ms")
+        print(f"Max Latency:    {overall.max():.2f} ms")
+
+        if self.options.mode in ("open", "replay"):
+            lag = self.stats["send_lag"]
+            service = self.stats["service_latency"]
+            if self.options.mode == "replay":
+                print("\nReplay schedule:")
+                print(f"Speed:          {self.options.replay_speed:g}x")
+                print(
+                    f"Skipped Lines:  {self.stats['replay_unparsed']} unparsed, "
+                    f"{self.stats['replay_filtered']} filtered (method, path prefix or --replay-exclude)"
+                )
+            else:
+                print("\nOpen-loop schedule:")
+                print(f"Target Rate:    {self.options.rps:.1f} req/s ({self.options.arrival})")
+            print(f"Scheduled:      {self.stats['scheduled']}")
+            print(
+                f"Late Sends:     {self.stats['late']} (> {LATE_SEND_THRESHOLD_MS} ms behind schedule, "
+                f"p99 lag {lag.percentile(99):.1f} ms, max {lag.max():.1f} ms)"
+            )
+            print(f"Missed Sends:   {self.stats['missed']} (in-flight cap {self.options.max_in_flight})")
+            print(
+                f"Service Time:   p50 {service.percentile(50):.1f} ms, p99 {service.percentile(99):.1f} ms "
+                "(latencies below are measured from the intended send time)"
+            )
+
+        new_conns = self.stats["connections_new"]
+        reused_conns = self.stats["connections_reused"]
+        print("\nConnections:")
+        print(f"New / Reused:   {new_conns} / {reused_conns}")
+        for label, key in (
+            ("Pool Wait", "pool_wait"),
+            ("DNS Lookup", "dns"),
+            ("Connect+TLS", "connect"),
+            ("Request*", "request_excl_connect"),
+        ):
+            hist = self.stats[key]
+            if hist.total:
+                print(
+                    f"{label + ':':<15} p50 {hist.percentile(50):.1f} ms, p99 {hist.percentile(99):.1f} ms, "
+                    f"max {hist.max():.1f} ms ({hist.total} samples)"
+                )
+        print("* start to response headers, excluding pool wait and connection setup")
+        if self.stats["relogins"]:
+            print(f"Re-logins:      {self.stats['relogins']} (tokens rejected with 401)")
+        if self.stats["aborted_journeys"]:
+            print(f"Aborted Journeys: {self.stats['aborted_journeys']} (failed step or missing extract value)")
+        invalid = {}
+        for entry in self.stats["endpoints"].values():
+            for key, count in entry["errors_by_status"].items():
+                if key.startswith("invalid:"):
+                    invalid[key[8:]] = invalid.get(key[8:], 0) + count
+        if invalid:
+            print("Failed Checks:  " + ", ".join(f"{reason} {count}" for reason, count in sorted(invalid.items())))
+        if self.stats["sampled_failures"]:
+            print(
+                f"Sampled Checks: {self.stats['sampled_failures']} failed in a "
+                f"{self.options.validate_sample:.0%} decode sample of key-only steps"
+            )
+
+        self.report_errors()
+        if self.stats["stages"]:
+            self.report_stages()
+        self.report_server_timing()
+        if self.options.mode == "websocket":
+            delivered = self.stats["endpoints"].get("WS Fan-out Delivery", {}).get("requests", 0)
+            print(f"\nWebsocket fan-out: {self.stats['ws_published']} published, {delivered} deliveries")
+
+        print("\nLatency percentiles (ms):")
+        header = f"{'Endpoint':<28} {'Reqs':>8} {'Errs':>6} {'Avg KB':>8}" + "".join(
+            f" {'p' + format(p, 'g'):>9}" for p in REPORT_PERCENTILES
+        ) + f" {'max':>9}"
+        print(header)
+        print("-" * len(header))
+        rows = sorted(self.stats["endpoints"].items())
+        rows.append(
+            ("Overall", {"requests": total_reqs, "errors": self.stats["errors"], "bytes": received, "latency": overall})
+        )
+        for name, entry in rows:
+            hist = entry["latency"]
+            avg_kb = entry["bytes"] / entry["requests"] / 1024 if entry["requests"] else 0.0
+            print(
+                f"{name[:28]:<28} {entry['requests']:>8} {entry['errors']:>6} {avg_kb:>8.1f}"
+                + "".join(f" {hist.percentile(p):>9.1f}" for p in REPORT_PERCENTILES)
+                + f" {hist.max():>9.1f}"
+            )
         print("------------------------")
 
 
+# Per-endpoint histograms: client latency, plus server-reported time and
+# client-minus-server overhead for responses carrying timing headers
+HISTOGRAM_FIELDS = ("latency", "server", "overhead")
+
+
+def endpoint_entry(table, name):
+    """Returns the (lazily created) counters and histogram for ``name`` in ``table``."""
+    entry = table.get(name)
+    if entry is None:
+        entry = {"requests": 0, "errors": 0, "errors_by_status": {}, "bytes": 0, "latency": LatencyHistogram()}
+        table[name] = entry
+    return entry
+
+
+def export_endpoints(table):
+    return {
+        name: {
+            field: value.to_dict() if isinstance(value, LatencyHistogram) else value
+            for field, value in entry.items()
+        }
+        for name, entry in table.items()
+    }
+
+
+def merge_endpoints(table, exported):
+    """Adds exported per-endpoint stats into ``table``."""
+    for name, entry in exported.items():
+        target = endpoint_entry(table, name)
+        for field, value in entry.items():
+            if field in HISTOGRAM_FIELDS:
+                hist = target.get(field)
+                if hist is None:
+                    hist = target[field] = LatencyHistogram()
+                hist.merge(LatencyHistogram.from_dict(value))
+            elif isinstance(value, dict):
+                counts = target.setdefault(field, {})
+                for key, count in value.items():
+                    counts[key] = counts.get(key, 0) + count
+            else:
+                target[field] = target.get(field, 0) + value
+
+
+def server_time_ms(headers):
+    """Application time in ms reported by response headers, or None.
+
+    ``Server-Timing`` is preferred (its ``total`` metric, else ``app``, else
+    the largest ``dur``), then ``X-Response-Time`` (``12.3ms``, ``0.0123s`` or
+    bare milliseconds) and ``X-Runtime`` (seconds).
+    """
+    timings = headers.getall("Server-Timing", None)
+    if timings:
+        durations = {}
+        for metric in ",".join(timings).split(","):
+            name, _, params = metric.partition(";")
+            for param in params.split(";"):
+                key, _, value = param.partition("=")
+                if key.strip() == "dur":
+                    try:
+                        durations[name.strip()] = float(value.strip().strip('"'))
+                    except ValueError:
+                        pass
+        if durations:
+            return durations.get("total", durations.get("app", max(durations.values())))
+    value = headers.get("X-Response-Time")
+    if value:
+        value = value.strip().lower()
+        try:
+            if value.endswith("ms"):
+                return float(value[:-2])
+            if value.endswith("s"):
+                return float(value[:-1]) * 1000
+            return float(value)
+        except ValueError:
+            pass
+    value = headers.get("X-Runtime")
+    if value:
+        try:
+            return float(value) * 1000
+        except ValueError:
+            pass
+    return None
+
+
+def build_live_row(interval, elapsed, span):
+    """Summarises one live interval as a JSON-serialisable row."""
+    span = max(span, 1e-9)
+    overall = LatencyHistogram()
+    endpoints = {}
+    requests = errors = received = 0
+    for name, entry in sorted(interval.items()):
+        hist = entry["latency"]
+        overall.merge(hist)
+        requests += entry["requests"]
+        errors += entry["errors"]
+        received += entry["bytes"]
+        endpoints[name] = {
+            "requests": entry["requests"],
+            "rps": round(entry["requests"] / span, 2),
+            "errors": entry["errors"],
+            "bytes": entry["bytes"],
+            "p50_ms": hist.percentile(50),
+            "p95_ms": hist.percentile(95),
+            "p99_ms": hist.percentile(99),
+            "max_ms": hist.max(),
+        }
+    return {
+        "ts": datetime.now().isoformat(timespec="seconds"),
+        "elapsed_s": round(elapsed, 3),
+        "interval_s": round(span, 3),
+        "requests": requests,
+        "rps": round(requests / span, 2),
+        "errors": errors,
+        "error_rate": round(errors / requests, 4) if requests else 0.0,
+        "received_bytes_per_s": round(received / span, 1),
+        "p50_ms": overall.percentile(50),
+        "p95_ms": overall.percentile(95),
+        "p99_ms": overall.percentile(99),
+        "max_ms": overall.max(),
+        "endpoints": endpoints,
+    }
+
+
+def decode_pusher_data(data):
+    """Pusher wraps event payloads in a JSON string; returns the decoded value."""
+    if isinstance(data, str):
+        try:
+            return json.loads(data)
+        except ValueError:
+            return data
+    return data if data is not None else {}
+
+
+def profile_levels(options):
+    """Levels of a step/ramp profile: start, start+step, ... up to and including end."""
+    start, end, step = options.profile_start, options.profile_end, options.profile_step
+    if step <= 0 or end < start:
+        return [start]
+    levels = []
+    level = start
+    while level < end:
+        levels.append(level)
+        level += step
+    levels.append(end)
+    return levels
+
+
+def peak_users(options):
+    """Most virtual users alive at once: ``--users``, or the top closed-loop profile level."""
+    users = options.users
+    if options.profile != "constant" and options.mode != "open":
+        users = max(users, int(max(profile_levels(options))))
+    return users
+
+
+def summarize_stages(stages):
+    """Throughput and latency per profile stage, plus growth vs the previous stage."""
+    summaries = []
+    previous = None
+    for stage in stages:
+        hist = LatencyHistogram()
+        requests = errors = 0
+        for entry in stage["endpoints"].values():
+            hist.merge(entry["latency"])
+            requests += entry["requests"]
+            errors += entry["errors"]
+        elapsed = stage["elapsed_s"] or 1e-9
+        summary = {
+            "level": stage["level"],
+            "elapsed_s": round(stage["elapsed_s"], 3),
+            "requests": requests,
+            "errors": errors,
+            "error_rate": round(errors / requests, 5) if requests else 0.0,
+            "throughput_rps": round(requests / elapsed, 3),
+            "p50_ms": hist.percentile(50),
+            "p95_ms": hist.percentile(95),
+            "p99_ms": hist.percentile(99),
+            "throughput_gain": 0.0,
+            "level_gain": 0.0,
+        }
+        if previous is not None:
+            if previous["throughput_rps"]:
+                summary["throughput_gain"] = round(
+                    (summary["throughput_rps"] - previous["throughput_rps"]) / previous["throughput_rps"], 4
+                )
+            if previous["level"]:
+                summary["level_gain"] = round((summary["level"] - previous["level"]) / previous["level"], 4)
+        summaries.append(summary)
+        previous = summary
+    return summaries
+
+
+def detect_saturation(summaries, plateau_ratio=SATURATION_PLATEAU_RATIO, p99_growth=SATURATION_P99_GROWTH):
+    """Index of the first stage past the saturation knee, or None.
+
+    A stage is saturated when throughput grew by less than ``plateau_ratio``
+    of the relative load increase (it plateaued) while p99 grew by at least
+    ``p99_growth``x over the previous stage.
+    """
+    for index in range(1, len(summaries)):
+        stage, previous = summaries[index], summaries[index - 1]
+        if stage["level_gain"] <= 0 or not previous["p99_ms"]:
+            continue
+        plateaued = stage["throughput_gain"] < plateau_ratio * stage["level_gain"]
+        p99_spiked = stage["p99_ms"] >= p99_growth * previous["p99_ms"]
+        if plateaued and p99_spiked:
+            return index
+    return None
+
+
+def load_accounts(options):
+    """Returns ``(email, password)`` pairs from the configured credentials source.
+
+    ``--credentials`` accepts a CSV file with ``email`` and ``password`` columns
+    or a JSONL file of ``{"email": ..., "password": ...}`` objects. Otherwise
+    ``--email-pattern`` (e.g. ``loadtest+{n}@example.com``) generates
+    ``--accounts`` seeded accounts sharing one password, by default one per
+    user at the peak profile level. Without either, the
+    single TEST_USER_EMAIL account is shared by every virtual user.
+    """
+    if options.credentials:
+        accounts = []
+        with open(options.credentials, encoding="utf-8", newline="") as f:
+            if options.credentials.endswith((".jsonl", ".ndjson")):
+                for line in f:
+                    if line.strip():
+                        row = json.loads(line)
+                        accounts.append((row["email"], row.get("password", options.password)))
+            else:
+                for row in csv.DictReader(f):
+                    accounts.append((row["email"], row.get("password") or options.password))
+    elif options.email_pattern:
+        count = options.accounts or peak_users(options)
+        accounts = [(options.email_pattern.format(n=n), options.password) for n in range(1, count + 1)]
+    else:
+        accounts = [(options.email, options.password)]
+
+    if options.accounts:
+        accounts = accounts[: options.accounts]
+    return accounts
+
+
+def load_token_cache(path):
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_token_cache(path, cache):
+    """Writes the cache atomically, readable only by its owner (it holds bearer tokens)."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, path)
+
+
+def _pct_change(baseline, current):
+    return (current - baseline) / baseline * 100.0 if baseline else 0.0
+
+
+def compare_results(baseline, current, max_p95_increase, max_throughput_drop, max_error_rate_increase, min_requests,
+                    max_bytes_increase=20.0):
+    """Diffs two ``--json-out`` artifacts and flags regressions.
+
+    p95 latency (overall and per endpoint with at least ``min_requests`` in
+    both runs) regresses when it grows by more than ``max_p95_increase``
+    percent; throughput when it drops by more than ``max_throughput_drop``
+    percent; error rate when it rises by more than ``max_error_rate_increase``
+    percentage points. Average response size is compared on the same scopes
+    against ``max_bytes_increase`` percent when both artifacts record it.
+    """
+    checks = []
+
+    def add(scope, metric, base, curr, change, threshold, regressed):
+        checks.append({
+            "scope": scope,
+            "metric": metric,
+            "baseline": base,
+            "current": curr,
+            "change": round(change, 2),
+            "threshold": threshold,
+            "regressed": regressed,
+        })
+
+    base_summary = baseline["summary"]
+    curr_summary = current["summary"]
+
+    base_rps, curr_rps = base_summary["throughput_rps"], curr_summary["throughput_rps"]
+    change = _pct_change(base_rps, curr_rps)
+    add("overall", "throughput_rps", base_rps, curr_rps, change, max_throughput_drop, -change > max_throughput_drop)
+
+    base_err, curr_err = base_summary["error_rate"] * 100, curr_summary["error_rate"] * 100
+    change = curr_err - base_err
+    add("overall", "error_rate_pct", round(base_err, 3), round(curr_err, 3), change,
+        max_error_rate_increase, change > max_error_rate_increase)
+
+    scopes = [("overall", base_summary, curr_summary)]
+    for name in sorted(set(baseline["endpoints"]) & set(current["endpoints"])):
+        base_ep, curr_ep = baseline["endpoints"][name], current["endpoints"][name]
+        if base_ep["requests"] >= min_requests and curr_ep["requests"] >= min_requests:
+            scopes.append((name, base_ep, curr_ep))
+    for scope, base, curr in scopes:
+        base_p95, curr_p95 = base["percentiles_ms"]["p95"], curr["percentiles_ms"]["p95"]
+        change = _pct_change(base_p95, curr_p95)
+        add(scope, "p95_ms", base_p95, curr_p95, change, max_p95_increase, change > max_p95_increase)
+        base_size, curr_size = base.get("avg_response_bytes"), curr.get("avg_response_bytes")
+        if base_size is not None and curr_size is not None:
+            change = _pct_change(base_size, curr_size)
+            add(scope, "avg_response_bytes", base_size, curr_size, change, max_bytes_increase,
+                change > max_bytes_increase)
+
+    return {
+        "baseline_generated_at": baseline.get("generated_at"),
+        "current_generated_at": current.get("generated_at"),
+        "endpoints_added": sorted(set(current["endpoints"]) - set(baseline["endpoints"])),
+        "endpoints_removed": sorted(set(baseline["endpoints"]) - set(current["endpoints"])),
+        "checks": checks,
+        "regressions": [check for check in checks if check["regressed"]],
+    }
+
+
+def write_comparison_markdown(path, comparison, baseline_path, current_path):
+    lines = [
+        "# Load Test Comparison",
+        "",
+        f"- **Baseline:** `{baseline_path}`",
+        f"- **Current:** `{current_path}`",
+        f"- **Regressions:** `{len(comparison['regressions'])}`",
+        "",
+        "| Scope | Metric | Baseline | Current | Change | Threshold | Status |",
+        "| --- | --- | --- | --- | --- | --- | --- |",
+    ]
+    for check in comparison["checks"]:
+        unit = "pp" if check["metric"] == "error_rate_pct" else "%"
+        status = "REGRESSED" if check["regressed"] else "ok"
+        lines.append(
+            f"| {check['scope']} | {check['metric']} | {check['baseline']} | {check['current']} "
+            f"| {check['change']:+.2f}{unit} | {check['threshold']}{unit} | {status} |"
+        )
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def compare_main(argv):
+    """``compare`` command: exits non-zero when the current run regressed."""
+    parser = argparse.ArgumentParser(
+        prog="load_test.py compare",
+        description="Compare two load test result artifacts and fail on regressions.",
+    )
+    parser.add_argument("baseline", help="Result JSON of the baseline run")
+    parser.add_argument("current", help="Result JSON of the run under test")
+    parser.add_argument("--max-p95-increase", type=float, default=10.0,
+                        help="Allowed p95 latency growth in percent (default 10)")
+    parser.add_argument("--max-throughput-drop", type=float, default=10.0,
+                        help="Allowed throughput drop in percent (default 10)")
+    parser.add_argument("--max-error-rate-increase", type=float, default=1.0,
+                        help="Allowed error rate increase in percentage points (default 1)")
+    parser.add_argument("--max-bytes-increase", type=float, default=20.0,
+                        help="Allowed average response size growth in percent (default 20)")
+    parser.add_argument("--min-requests", type=int, default=50,
+                        help="Ignore endpoints with fewer requests in either run (default 50)")
+    parser.add_argument("--json-out", help="Write the comparison as JSON")
+    parser.add_argument("--md-out", help="Write the comparison as Markdown")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+
+    comparison = compare_results(
+        baseline, current,
+        args.max_p95_increase, args.max_throughput_drop,
+        args.max_error_rate_increase, args.min_requests, args.max_bytes_increase,
+    )
+
+    print(f"{'Scope':<28} {'Metric':<18} {'Baseline':>10} {'Current':>10} {'Change':>9}  Status")
+    for check in comparison["checks"]:
+        unit = "pp" if check["metric"] == "error_rate_pct" else "%"
+        print(
+            f"{check['scope'][:28]:<28} {check['metric']:<18} {check['baseline']:>10} {check['current']:>10} "
+            f"{check['change']:>+8.2f}{unit}  {'REGRESSED' if check['regressed'] else 'ok'}"
+        )
+    for name in comparison["endpoints_added"]:
+        print(f"New endpoint in current run: {name}")
+    for name in comparison["endpoints_removed"]:
+        print(f"Endpoint missing from current run: {name}")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(comparison, f, indent=2)
+    if args.md_out:
+        write_comparison_markdown(args.md_out, comparison, args.baseline, args.current)
+
+    if comparison["regressions"]:
+        print(f"\n❌ {len(comparison['regressions'])} regression(s) beyond thresholds.")
+        return 1
+    print("\n✅ No regressions beyond thresholds.")
+    return 0
+
+
+def stub_main(argv):
+    """``stub`` command: serves the local stub API (see load_test_stub.py)."""
+    from load_test_stub import main
+
+    return main(argv, prog="load_test.py stub")
+
+
+def _free_port(host):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(host, port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def selfbench_main(argv):
+    """``selfbench`` command: measures the generator's own ceiling against the stub.
+
+    Runs a zero-think-time closed loop against local stub processes and
+    reports the maximum req/s reached and generator CPU per request. Give
+    the stub enough processes that it is not the bottleneck; if
+    ``cpu / wall`` per generator process is near 1.0 the generator is
+    CPU-bound and more --workers will raise the ceiling.
+    """
+    parser = argparse.ArgumentParser(
+        prog="load_test.py selfbench",
+        description="Benchmark the load generator against the built-in stub API.",
+    )
+    parser.add_argument("--users", type=int, default=200, help="Concurrent zero-think-time users")
+    parser.add_argument("--duration", type=int, default=15, help="Seconds to run")
+    parser.add_argument("--workers", type=int, default=1, help="Generator processes")
+    parser.add_argument("--stub-processes", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="Stub server processes (default: half the CPUs)")
+    parser.add_argument("--latency", default="fixed:0", help="Stub latency spec (see `stub --help`)")
+    parser.add_argument("--items", type=int, default=20, help="Items in stub list responses")
+    parser.add_argument("--scenario", help="Scenario file to benchmark (default: the built-in ENDPOINTS mix)")
+    parser.add_argument("--json-out", help="Write the result artifact to this file")
+    args = parser.parse_args(argv)
+
+    from load_test_stub import start_processes
+
+    host = "127.0.0.1"
+    port = _free_port(host)
+    stubs = start_processes(host, port, args.stub_processes, latency=args.latency, items=args.items)
+    try:
+        if not _wait_for_port(host, port):
+            print("Stub server did not start.")
+            return 1
+        load_args = [
+            "--base-url", f"http://{host}:{port}/api",
+            "--users", str(args.users), "--duration", str(args.duration), "--workers", str(args.workers),
+            "--mode", "closed", "--profile", "constant", "--think-time", "0",
+            "--pool-size", "0", "--live-interval", "0", "--token-cache", "",
+        ]
+        if args.scenario:
+            load_args += ["--scenario", args.scenario]
+        if args.json_out:
+            load_args += ["--json-out", args.json_out]
+        options = parse_args(load_args)
+        if options.workers > 1:
+            tester = run_workers(options)
+        else:
+            tester = LoadTester(options)
+            asyncio.run(tester.run())
+    finally:
+        for stub in stubs:
+            stub.terminate()
+
+    if tester is None or not tester.stats["requests"]:
+        return 1
+    elapsed = tester.elapsed()
+    requests = tester.stats["requests"]
+    print("\n--- Generator Self-Benchmark ---")
+    print(f"Stub:           {args.stub_processes} process(es), latency {args.latency}")
+    print(f"Generator:      {options.workers} process(es), {options.users} users, zero think time")
+    print(f"Max Throughput: {requests / elapsed:.0f} req/s")
+    print(f"CPU / Request:  {tester.stats['cpu_s'] / requests * 1e6:.0f} us")
+    print(f"CPU / Wall:     {tester.stats['cpu_s'] / elapsed / options.workers:.2f} per generator process")
+    return 0
+
+
+# Sub-commands dispatched on the first argument; anything else runs a load test
+COMMANDS = {
+    "compare": compare_main,
+    "stub": stub_main,
+    "selfbench": selfbench_main,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="fwber API load tester.")
+    parser.add_argument("--base-url", default=BASE_URL,
+                        help="API base URL, e.g. http://localhost:8000/api (env API_BASE_URL)")
+    parser.add_argument("--users", type=int, default=CONCURRENT_USERS,
+                        help="Concurrent virtual users in closed-loop mode")
+    parser.add_argument("--duration", type=int, default=DURATION,
+                        help="Test duration in seconds (0 for infinite)")
+    parser.add_argument("--mode", choices=["closed", "open", "replay", "websocket"], default=LOAD_MODE,
+                        help="closed: users wait for responses; open: constant arrival rate; "
+                             "replay: re-issue a recorded access log; websocket: hold --users Reverb connections")
+    parser.add_argument("--rps", type=float, default=TARGET_RPS,
+                        help="Target request rate in open-loop mode")
+    parser.add_argument("--arrival", choices=["poisson", "fixed"], default=ARRIVAL,
+                        help="Open-loop arrival process")
+    parser.add_argument("--max-in-flight", type=int, default=MAX_IN_FLIGHT,
+                        help="Open-loop cap on outstanding requests")
+    parser.add_argument("--replay", default=REPLAY_FILE,
+                        help="Access log to replay: nginx combined format or JSONL (.gz allowed)")
+    parser.add_argument("--replay-format", choices=["auto", "nginx", "jsonl"], default="auto",
+                        help="Log format (auto: JSONL for .jsonl/.ndjson files, else nginx)")
+    parser.add_argument("--replay-speed", type=float, default=REPLAY_SPEED,
+                        help="Replay time compression, e.g. 2 replays an hour of traffic in 30 minutes")
+    parser.add_argument("--replay-methods", default=REPLAY_METHODS,
+                        help="Comma-separated methods to replay (nginx logs carry no request bodies)")
+    parser.add_argument("--replay-exclude", default=REPLAY_EXCLUDE,
+                        help="Regex of request paths to skip")
+    parser.add_argument("--replay-user-map", default=REPLAY_USER_MAP,
+                        help="JSON object mapping logged users/IPs to test account emails "
+                             "(unmapped clients are hashed onto the account pool)")
+    parser.add_argument("--scenario", default=SCENARIO_FILE,
+                        help="JSON/YAML scenario file (default: the built-in ENDPOINTS mix)")
+    parser.add_argument("--validate-sample", type=float, default=VALIDATE_SAMPLE,
+                        help="Fraction of responses to key-only 'expect' steps that are fully decoded "
+                             "and checked (default 0.05; 1.0 decodes every response; steps with "
+                             "min_items or extract are always decoded; sampled failures are scaled "
+                             "up in the error rate)")
+    parser.add_argument("--think-time", type=lambda value: _think_time(
+                            [float(v) for v in value.split(":")] if ":" in value else float(value), None),
+                        default=None,
+                        help="Override every step's think time: SECONDS or MIN:MAX")
+    parser.add_argument("--email", default=EMAIL,
+                        help="Account used when no credentials source is given")
+    parser.add_argument("--password", default=PASSWORD,
+                        help="Password for --email / --email-pattern accounts")
+    parser.add_argument("--credentials", default=CREDENTIALS_FILE,
+                        help="CSV (email,password) or JSONL file of test accounts")
+    parser.add_argument("--email-pattern", default=EMAIL_PATTERN,
+                        help="Seeded account pattern, e.g. loadtest+{n}@example.com")
+    parser.add_argument("--accounts", type=int, default=0,
+                        help="Number of accounts to use (default: one per user for --email-pattern)")
+    parser.add_argument("--login-concurrency", type=int, default=LOGIN_CONCURRENCY,
+                        help="Concurrent logins during startup")
+    parser.add_argument("--token-cache", default=TOKEN_CACHE,
+                        help="File caching tokens between runs (empty string disables)")
+    parser.add_argument("--refresh-tokens", action="store_true",
+                        help="Ignore cached tokens and log in again")
+    parser.add_argument("--token-ttl", type=float, default=TOKEN_TTL,
+                        help="Seconds a cached token is reused (0 = until the API rejects it)")
+    parser.add_argument("--pool-size", type=int, default=POOL_SIZE,
+                        help="Total connections in the HTTP pool (0 = unlimited)")
+    parser.add_argument("--limit-per-host", type=int, default=LIMIT_PER_HOST,
+                        help="Connections per host (0 = unlimited)")
+    parser.add_argument("--dns-ttl", type=int, default=DNS_TTL,
+                        help="DNS cache TTL in seconds (0 disables the cache)")
+    parser.add_argument("--keepalive-timeout", type=float, default=KEEPALIVE_TIMEOUT,
+                        help="Seconds an idle keep-alive connection stays in the pool")
+    parser.add_argument("--force-close", action="store_true", default=FORCE_CLOSE,
+                        help="Open a new connection for every request (disables keep-alive)")
+    parser.add_argument("--live-interval", type=float, default=LIVE_INTERVAL,
+                        help="Seconds between live metric lines (0 disables)")
+    parser.add_argument("--live-jsonl", default=LIVE_JSONL,
+                        help="Append one JSON row per live interval to this file")
+    parser.add_argument("--json-out", default=RESULTS_JSON,
+                        help="Write a machine-readable result artifact to this file")
+    parser.add_argument("--slowest", type=int, default=SLOWEST_REQUESTS,
+                        help="Slowest requests kept with their X-Request-Id for the report and --json-out")
+    parser.add_argument("--ws-url", default=WS_URL,
+                        help="Reverb base URL (http(s) is mapped to ws(s))")
+    parser.add_argument("--ws-app-key", default=REVERB_APP_KEY,
+                        help="Reverb app key")
+    parser.add_argument("--ws-auth-url", default=WS_AUTH_URL,
+                        help="Broadcasting auth endpoint for private/presence channels (default: --base-url + /broadcasting/auth)")
+    parser.add_argument("--ws-channels", type=lambda value: [c.strip() for c in value.split(",") if c.strip()],
+                        default=WS_CHANNELS,
+                        help="Comma-separated channel templates ({user_id}, {email}, {account})")
+    parser.add_argument("--ws-connect-rate", type=float, default=WS_CONNECT_RATE,
+                        help="New websocket connections per second (0 = all at once)")
+    parser.add_argument("--ws-publishers", type=int, default=WS_PUBLISHERS,
+                        help="Connections that publish fan-out client events")
+    parser.add_argument("--ws-publish-interval", type=float, default=WS_PUBLISH_INTERVAL,
+                        help="Seconds between client events per publisher")
+    parser.add_argument("--ws-publish-channel", default=None,
+                        help="Channel for client events (default: first --ws-channels entry)")
+    parser.add_argument("--profile", choices=["constant", "step", "ramp"], default=LOAD_PROFILE,
+                        help="constant load, or step/ramp from --profile-start to --profile-end")
+    parser.add_argument("--profile-start", type=float, default=PROFILE_START,
+                        help="First profile level (users, or req/s in open-loop mode)")
+    parser.add_argument("--profile-end", type=float, default=PROFILE_END,
+                        help="Last profile level")
+    parser.add_argument("--profile-step", type=float, default=PROFILE_STEP,
+                        help="Level increase per stage")
+    parser.add_argument("--step-duration", type=float, default=STEP_DURATION,
+                        help="Seconds per profile stage")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="Generator processes, each with its own event loop and session")
+    options = parser.parse_args(argv)
+    options.base_url = options.base_url.rstrip("/")
+    if not options.ws_auth_url:
+        options.ws_auth_url = f"{options.base_url}/broadcasting/auth"
+    if options.workers < 1:
+        parser.error("--workers must be at least 1")
+    if options.mode == "websocket" and not options.ws_app_key:
+        parser.error("--ws-app-key (or FWBER_REVERB_APP_KEY) is required in websocket mode")
+    if options.mode == "replay":
+        if not options.replay:
+            parser.error("--replay (or LOAD_REPLAY_FILE) is required in replay mode")
+        if options.replay_speed <= 0:
+            parser.error("--replay-speed must be positive")
+        if options.profile != "constant":
+            parser.error("--profile is not supported in replay mode; use --replay-speed")
+    if options.mode == "open" and options.rps <= 0:
+        parser.error("--rps must be positive in open-loop mode")
+    return options
+
+
+def _split(total, parts, index):
+    """Share of ``total`` assigned to part ``index`` when divided as evenly as possible."""
+    return total // parts + (1 if index < total % parts else 0)
+
+
+def _worker_main(options, worker_id, user_offset, identities, results):
+    tester = LoadTester(options, worker_id=worker_id, user_offset=user_offset)
+    tester.identities = identities
+    try:
+        asyncio.run(tester.run(report=False, live_sink=lambda interval: results.put(("interval", interval))))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Always report back so the parent never waits on a crashed worker
+        results.put(("final", tester.export_stats()))
+
+
+def run_workers(options):
+    """Runs the test in ``options.workers`` processes and reports their merged stats.
+
+    Closed-loop users, the open-loop target rate and the in-flight cap are
+    divided between workers, so the offered load matches a single-process run
+    with the same settings.
+    """
+    parent = LoadTester(options)
+    parent.print_banner()
+
+    # Log in once up front so workers share the identity pool instead of each
+    # repeating the login storm
+    async def authenticate():
+        async with aiohttp.ClientSession(connector=parent.build_connector()) as session:
+            return await parent.authenticate(session)
+
+    if not asyncio.run(authenticate()):
+        print("Aborting: Could not authenticate.")
+        return None
+
+    # Each worker numbers its virtual users from its own offset so no two
+    # workers bind the same accounts; profiles reserve room for the top level
+    peak = peak_users(options)
+
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    results = ctx.Queue()
+    processes = []
+    user_offset = 0
+    for worker_id in range(options.workers):
+        worker_options = argparse.Namespace(**vars(options))
+        worker_options.users = _split(options.users, options.workers, worker_id)
+        worker_options.rps = options.rps / options.workers
+        worker_options.max_in_flight = max(1, math.ceil(options.max_in_flight / options.workers))
+        process = ctx.Process(
+            target=_worker_main,
+            args=(worker_options, worker_id, user_offset, parent.identities, results),
+            name=f"load-test-worker-{worker_id}",
+        )
+        process.start()
+        processes.append(process)
+        user_offset += _split(peak, options.workers, worker_id)
+
+    collected = 0
+    live_interval = options.live_interval
+    parent.started = parent.live_started = parent.live_last = time.perf_counter()
+
+    def handle(message):
+        nonlocal collected
+        kind, payload = message
+        if kind == "interval":
+            merge_endpoints(parent.interval, payload)
+        else:
+            parent.merge_stats(payload)
+            collected += 1
+
+    try:
+        while collected < len(processes):
+            try:
+                handle(results.get(timeout=live_interval or None))
+            except queue.Empty:
+                pass
+            if live_interval and time.perf_counter() - parent.live_last >= live_interval:
+                parent.emit_live()
+    except KeyboardInterrupt:
+        # Workers receive the same SIGINT and still hand back partial stats
+        print("\nTest interrupted by user.")
+        deadline = time.time() + 10
+        while collected < len(processes) and time.time() < deadline:
+            try:
+                handle(results.get(timeout=max(0.1, deadline - time.time())))
+            except queue.Empty:
+                break
+    parent.finished = time.perf_counter()
+    if live_interval and parent.interval:
+        parent.emit_live()
+
+    for process in processes:
+        process.join(timeout=5)
+    if collected < len(processes):
+        print(f"Warning: only {collected}/{len(processes)} workers reported results.")
+    parent.finish()
+    return parent
+
+
 if __name__ == "__main__":
-    tester = LoadTester()
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+
+    options = parse_args()
+    if options.workers > 1:
+        run_workers(options)
+        sys.exit(0)
+
+    tester = LoadTester(options)
     try:
         asyncio.run(tester.run())
     except KeyboardInterrupt:
         print("\nTest interrupted by user.")
-        tester.report()
+        tester.finish()
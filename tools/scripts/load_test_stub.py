@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""Local stub of the fwber API endpoints exercised by load_test.py.
+
+Serves canned JSON for the routes in load_test.ENDPOINTS (plus login and the
+scenario journey routes) with configurable latency distributions and payload
+sizes, so the load generator can be benchmarked and tested without a backend.
+Each response carries ``Server-Timing: app;dur=<sampled latency>`` and an
+``X-Request-Id``:
+
+    python tools/scripts/load_test_stub.py --port 8000 --latency exp:20 \
+        --route-latency /matches=lognormal:80:0.5 --items 50
+
+Response bodies are serialised once at startup; each request only sleeps for
+its sampled latency, so one stub process serves several thousand req/s.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import zlib
+
+from aiohttp import web
+
+# Routes served under the /api prefix; the key is what --route-latency matches
+ROUTES = [
+    ("GET", "/leaderboard"),
+    ("GET", "/matches"),
+    ("GET", "/messages/unread-count"),
+    ("GET", "/messages/{id}"),
+    ("POST", "/messages"),
+    ("GET", "/chatrooms/{tail:.*}"),
+    ("GET", "/recommendations/feed"),
+    ("POST", "/feedback"),
+]
+
+
+def parse_latency(spec):
+    """Parses a latency distribution into a sampler returning seconds.
+
+    Supported specs (all values in ms): ``fixed:MS``, ``uniform:MIN:MAX``,
+    ``exp:MEAN``, ``normal:MEAN:STDDEV`` and ``lognormal:MEDIAN:SIGMA``.
+    """
+    kind, _, rest = spec.partition(":")
+    try:
+        params = [float(value) for value in rest.split(":")] if rest else []
+        if kind == "fixed":
+            delay = params[0] / 1000.0
+            return lambda: delay
+        if kind == "uniform":
+            low, high = params[0] / 1000.0, params[1] / 1000.0
+            return lambda: random.uniform(low, high)
+        if kind == "exp":
+            mean = params[0] / 1000.0
+            return (lambda: random.expovariate(1.0 / mean)) if mean > 0 else (lambda: 0.0)
+        if kind == "normal":
+            mean, stddev = params[0] / 1000.0, params[1] / 1000.0
+            return lambda: max(0.0, random.gauss(mean, stddev))
+        if kind == "lognormal":
+            median, sigma = params[0] / 1000.0, params[1]
+            return lambda: median * math.exp(random.gauss(0.0, sigma))
+    except (IndexError, ValueError):
+        pass
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+
+def _items(count, item_bytes):
+    return [
+        {"id": n, "name": f"user{n}", "score": 1000 - n, "bio": "x" * item_bytes}
+        for n in range(1, count + 1)
+    ]
+
+
+def build_payloads(items, item_bytes):
+    """Pre-serialised response bodies per route."""
+    listing = _items(items, item_bytes)
+    return {
+        "/leaderboard": {"data": listing},
+        "/matches": {"matches": listing, "total": len(listing)},
+        "/messages/unread-count": {"count": 3},
+        "/messages/{id}": {"messages": listing},
+        "/messages": {"message": {"id": 1, "content": "ok"}},
+        "/chatrooms/{tail:.*}": {"data": listing},
+        "/recommendations/feed": {"data": listing},
+        "/feedback": {"success": True},
+    }
+
+
+def _json_response(body, headers=None):
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+def make_handler(body, sample_latency):
+    request_ids = itertools.count(1)
+    prefix = f"stub-{os.getpid()}-"
+
+    async def handler(request):
+        if request.body_exists:
+            await request.read()
+        delay = sample_latency()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return _json_response(body, {
+            "Server-Timing": f"app;dur={delay * 1000:.2f}",
+            "X-Request-Id": f"{prefix}{next(request_ids)}",
+        })
+
+    return handler
+
+
+async def login(request):
+    data = await request.json()
+    email = str(data.get("email", ""))
+    user_id = zlib.crc32(email.encode("utf-8")) % 1_000_000 + 1
+    return web.json_response({"token": f"stub-{user_id}", "user": {"id": user_id, "email": email}})
+
+
+def build_app(latency="fixed:0", route_latency=None, items=20, item_bytes=100):
+    """Creates the stub application.
+
+    ``route_latency`` maps route paths (as in ROUTES, without ``/api``) to
+    latency specs overriding ``latency``.
+    """
+    route_latency = route_latency or {}
+    default_sampler = parse_latency(latency)
+    payloads = build_payloads(items, item_bytes)
+
+    app = web.Application()
+    app.router.add_post("/api/auth/login", login)
+    for method, path in ROUTES:
+        sampler = parse_latency(route_latency[path]) if path in route_latency else default_sampler
+        body = json.dumps(payloads[path]).encode("utf-8")
+        app.router.add_route(method, f"/api{path}", make_handler(body, sampler))
+    return app
+
+
+def serve(host, port, latency, route_latency, items, item_bytes, reuse_port=False):
+    app = build_app(latency, route_latency, items, item_bytes)
+    web.run_app(app, host=host, port=port, reuse_port=reuse_port, print=None, handle_signals=True)
+
+
+def start_processes(host, port, processes, latency="fixed:0", route_latency=None, items=20, item_bytes=100):
+    """Starts ``processes`` stub servers sharing ``port`` via SO_REUSEPORT."""
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    started = []
+    for index in range(processes):
+        process = ctx.Process(
+            target=serve,
+            args=(host, port, latency, route_latency or {}, items, item_bytes, processes > 1),
+            name=f"load-test-stub-{index}",
+            daemon=True,
+        )
+        process.start()
+        started.append(process)
+    return started
+
+
+def parse_route_latency(values):
+    overrides = {}
+    for value in values or []:
+        path, sep, spec = value.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Expected PATH=SPEC, got {value!r}")
+        parse_latency(spec)
+        overrides[path] = spec
+    return overrides
+
+
+def build_parser(prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description="Local stub of the fwber API for load_test.py.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="fixed:0",
+                        help="Default latency: fixed:MS, uniform:MIN:MAX, exp:MEAN, normal:MEAN:SD, lognormal:MEDIAN:SIGMA")
+    parser.add_argument("--route-latency", action="append", metavar="PATH=SPEC",
+                        help="Per-route latency override, e.g. /matches=exp:80 (repeatable)")
+    parser.add_argument("--items", type=int, default=20,
+                        help="Items in list responses")
+    parser.add_argument("--item-bytes", type=int, default=100,
+                        help="Filler bytes per list item")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Server processes sharing the port (SO_REUSEPORT)")
+    return parser
+
+
+def main(argv=None, prog=None):
+    args = build_parser(prog).parse_args(argv)
+    route_latency = parse_route_latency(args.route_latency)
+    parse_latency(args.latency)
+
+    print(f"Stub API listening on http://{args.host}:{args.port}/api ({args.processes} process(es))")
+    if args.processes > 1:
+        processes = start_processes(
+            args.host, args.port, args.processes, args.latency, route_latency, args.items, args.item_bytes
+        )
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            pass
+    else:
+        serve(args.host, args.port, args.latency, route_latency, args.items, args.item_bytes)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Offline smoke tests: load_test.py against the in-process stub API.
+
+    python -m unittest tools/scripts/test_load_test.py
+"""
+
+import os
+import sys
+import unittest
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import LoadTester, parse_args  # noqa: E402
+from load_test_stub import build_app  # noqa: E402
+
+
+SCENARIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_scenarios", "chat_journey.yaml")
+
+
+class StubServerTestCase(unittest.IsolatedAsyncioTestCase):
+    items = 5
+
+    async def asyncSetUp(self):
+        self.runner = web.AppRunner(build_app(latency="fixed:1", items=self.items))
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/api"
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+    async def run_tester(self, *args):
+        options = parse_args([
+            "--base-url", self.base_url, "--duration", "1", "--think-time", "0",
+            "--token-cache", "", "--live-interval", "0", "--json-out", "", *args,
+        ])
+        tester = LoadTester(options)
+        await tester.run(report=False)
+        return tester
+
+
+class LoadTestStubSmokeTest(StubServerTestCase):
+    async def test_closed_loop(self):
+        tester = await self.run_tester("--mode", "closed", "--users", "2")
+        self.assertGreater(tester.stats["requests"], 0)
+        self.assertEqual(tester.stats["errors"], 0)
+        self.assertEqual(tester.identities[0]["token"][:5], "stub-")
+
+    async def test_open_loop(self):
+        tester = await self.run_tester("--mode", "open", "--rps", "50")
+        self.assertGreater(tester.stats["requests"], 20)
+        self.assertEqual(tester.stats["errors"], 0)
+        self.assertEqual(tester.stats["missed"], 0)
+
+    async def test_server_timing_is_parsed(self):
+        tester = await self.run_tester("--mode", "closed", "--users", "1")
+        self.assertTrue(any("server" in entry for entry in tester.stats["endpoints"].values()))
+
+
+class EmptyListSmokeTest(StubServerTestCase):
+    items = 0
+
+    async def test_empty_lists_fail_every_min_items_check(self):
+        tester = await self.run_tester("--mode", "closed", "--users", "2", "--scenario", SCENARIO)
+        feed = tester.stats["endpoints"]["Feed"]
+        self.assertGreater(feed["requests"], 0)
+        self.assertEqual(feed["errors_by_status"].get("invalid:too-few-items"), feed["requests"])
+
+
+if __name__ == "__main__":
+    unittest.main()